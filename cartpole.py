@@ -0,0 +1,156 @@
+import math
+
+import numpy as np
+
+
+class BatchedCartPole:
+    """
+    CartPole-v1 for many episodes at once, stepped as array operations.
+
+    The dynamics, termination, truncation, rewards and reset seeding follow gymnasium's
+    CartPoleEnv behind its 500 step time limit, so an episode seeded the same way
+    produces the same trajectory. Episodes that have ended stay frozen and return a
+    reward of 0 until the next reset.
+    """
+
+    GRAVITY = 9.8
+    MASS_CART = 1.0
+    MASS_POLE = 0.1
+    TOTAL_MASS = MASS_POLE + MASS_CART
+    LENGTH = 0.5  # actually half the pole's length
+    POLE_MASS_LENGTH = MASS_POLE * LENGTH
+    FORCE_MAG = 10.0
+    TAU = 0.02  # seconds between state updates
+
+    THETA_THRESHOLD_RADIANS = 12 * 2 * math.pi / 360
+    X_THRESHOLD = 2.4
+    MAX_EPISODE_STEPS = 500
+
+    def __init__(self, num_envs):
+        self.num_envs = num_envs
+        self.state = np.zeros((num_envs, 4), dtype=np.float64)
+        self.elapsed_steps = np.zeros(num_envs, dtype=np.int64)
+        self.terminated = np.zeros(num_envs, dtype=bool)
+        self.truncated = np.zeros(num_envs, dtype=bool)
+
+    def reset(self, seeds):
+        """
+        Reset every episode. `seeds` is one seed for all episodes or one seed per episode,
+        used exactly like gymnasium's env.reset(seed=...).
+        """
+        seeds = np.broadcast_to(np.asarray(seeds, dtype=object), (self.num_envs,))
+
+        # gymnasium seeds each env with a PCG64 generator over a SeedSequence, which is what default_rng does.
+        # Episodes that share a seed share a starting state, so each distinct seed is only drawn once.
+        starts = {}
+        for i, seed in enumerate(seeds):
+            if seed not in starts:
+                starts[seed] = np.random.default_rng(seed).uniform(low=-0.05, high=0.05, size=(4,))
+            self.state[i] = starts[seed]
+
+        self.elapsed_steps[:] = 0
+        self.terminated[:] = False
+        self.truncated[:] = False
+
+        return self.state.astype(np.float32)
+
+    def step(self, actions):
+        """
+        Advance every running episode by one step. Returns the observations, rewards,
+        terminated and truncated flags for all episodes.
+        """
+        running = ~(self.terminated | self.truncated)
+
+        x, x_dot, theta, theta_dot = self.state.T
+        force = np.where(np.asarray(actions) == 1, self.FORCE_MAG, -self.FORCE_MAG)
+        costheta = np.cos(theta)
+        sintheta = np.sin(theta)
+
+        temp = (force + self.POLE_MASS_LENGTH * np.square(theta_dot) * sintheta) / self.TOTAL_MASS
+        thetaacc = (self.GRAVITY * sintheta - costheta * temp) / (
+            self.LENGTH * (4.0 / 3.0 - self.MASS_POLE * np.square(costheta) / self.TOTAL_MASS)
+        )
+        xacc = temp - self.POLE_MASS_LENGTH * thetaacc * costheta / self.TOTAL_MASS
+
+        # Euler integration, gymnasium's default kinematics integrator
+        state = np.stack((
+            x + self.TAU * x_dot,
+            x_dot + self.TAU * xacc,
+            theta + self.TAU * theta_dot,
+            theta_dot + self.TAU * thetaacc
+        ), axis=1)
+
+        self.state[running] = state[running]
+        self.elapsed_steps[running] += 1
+
+        x, theta = self.state[:, 0], self.state[:, 2]
+        terminated = ((x < -self.X_THRESHOLD) | (x > self.X_THRESHOLD) |
+                      (theta < -self.THETA_THRESHOLD_RADIANS) | (theta > self.THETA_THRESHOLD_RADIANS))
+
+        # Like gymnasium's TimeLimit, an episode that terminates on its last step is also truncated.
+        self.terminated |= running & terminated
+        self.truncated |= running & (self.elapsed_steps >= self.MAX_EPISODE_STEPS)
+
+        rewards = running.astype(np.float64)
+
+        return self.state.astype(np.float32), rewards, self.terminated.copy(), self.truncated.copy()
+
+
+def check_parity(num_episodes=50, seed=0):
+    """
+    Run the same seeded episodes through gymnasium and the batched backend side by side
+    and check that the trajectories are identical step for step. Half of the episodes
+    take random actions and half use a simple balancing controller, so that both
+    termination and the 500 step truncation are exercised. The first episode is set up
+    to fall on its 500th step, which ends it both terminated and truncated.
+    """
+    import gymnasium
+
+    rng = np.random.default_rng(seed)
+    seeds = rng.integers(2 ** 31 - 1, size=num_episodes)
+    balancing = np.arange(num_episodes) % 2 == 0
+
+    envs = [gymnasium.make('CartPole-v1') for _ in range(num_episodes)]
+    observations = np.array([env.reset(seed=int(episode_seed))[0] for env, episode_seed in zip(envs, seeds)])
+
+    batched = BatchedCartPole(num_episodes)
+    batched_observations = batched.reset(seeds)
+    assert np.array_equal(observations, batched_observations), "Episodes start differently"
+
+    # A state one step away from the pole falling past the angle threshold.
+    falling = np.array([0.0, 0.0, BatchedCartPole.THETA_THRESHOLD_RADIANS - 1e-3, 1.0])
+
+    finished = np.zeros(num_episodes, dtype=bool)
+    step = 0
+    while not finished.all():
+        step += 1
+        if step == BatchedCartPole.MAX_EPISODE_STEPS:
+            assert not finished[0], "The balancing controller didn't reach the time limit"
+            envs[0].unwrapped.state = falling.copy()
+            batched.state[0] = falling
+        actions = np.where(balancing, observations[:, 2] + 0.5 * observations[:, 3] > 0,
+                           rng.integers(2, size=num_episodes)).astype(np.int64)
+        batched_observations, rewards, terminated, truncated = batched.step(actions)
+
+        for episode in np.flatnonzero(~finished):
+            observation, reward, term, trunc, _ = envs[episode].step(int(actions[episode]))
+            observations[episode] = observation
+
+            assert np.array_equal(observation, batched_observations[episode]), \
+                f"Episode {episode} diverged at step {step}"
+            assert (reward, term, trunc) == (rewards[episode], terminated[episode], truncated[episode]), \
+                f"Episode {episode} ended differently at step {step}"
+
+            finished[episode] = term or trunc
+
+    assert terminated[0] and truncated[0], "The first episode should end terminated and truncated"
+
+    for env in envs:
+        env.close()
+
+    print(f"{num_episodes} episodes matched gymnasium's CartPole-v1 "
+          f"({truncated.sum()} truncated, {terminated.sum()} terminated)")
+
+
+if __name__ == '__main__':
+    check_parity()
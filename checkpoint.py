@@ -0,0 +1,67 @@
+import os
+import pickle
+
+from parameters import Parameters
+
+
+class Checkpoint:
+    """
+    Saves a root team together with every team and learner reachable from it,
+    so that a policy can be loaded and run outside of the training process.
+    """
+
+    @staticmethod
+    def save(team, path, parameters=Parameters):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        with open(path, 'wb') as f:
+            pickle.dump({
+                'team': team,
+                'precision': parameters.PRECISION,
+                'actions': list(parameters.ACTIONS),
+                'num_observations': parameters.NUM_OBSERVATIONS
+            }, f)
+
+    @staticmethod
+    def load(path, precision=None):
+        """
+        Load a checkpointed team. Its learners keep the parameters of the run that trained
+        them and are converted to `precision`, by default the precision they were saved in.
+        """
+        with open(path, 'rb') as f:
+            checkpoint = pickle.load(f)
+
+        team = checkpoint['team']
+        for learner in Checkpoint.learners(team):
+            # Learners trained with the default parameters refer to the Parameters class, which may
+            # have been configured differently since.
+            assert learner.parameters.NUM_OBSERVATIONS == checkpoint['num_observations'], \
+                "The checkpoint was trained on a different observation size"
+            learner.neuralnet.astype(precision or checkpoint['precision'])
+
+        return team
+
+    @staticmethod
+    def path(run_id, generation, parameters=Parameters):
+        return os.path.join(parameters.CHECKPOINT_DIRECTORY, str(run_id), f'generation-{generation:05d}.pkl')
+
+    @staticmethod
+    def learners(team):
+        """
+        Every learner reachable from a team, each one once.
+        """
+        visited_teams, learners = set(), {}
+        pending = [team]
+
+        while pending:
+            team = pending.pop()
+            if team.id in visited_teams:
+                continue
+            visited_teams.add(team.id)
+
+            for learner in team.learners:
+                learners[learner.id] = learner
+                if not learner.is_atomic():
+                    pending.append(learner.action)
+
+        return list(learners.values())
@@ -1,17 +1,27 @@
-import csv
 import math
-import os
-from tempfile import NamedTemporaryFile
+import threading
 
 import numpy as np
-import psycopg2 as pg
+import pandas as pd
 from psycopg2 import Error
-from psycopg2 import sql
 import duckdb
 from parameters import Parameters
 
 
 class Database:
+    """
+    All access goes through one explicit duckdb connection with the Postgres database
+    attached as `db`. Each thread gets its own cursor on that connection, so threads
+    can read and write concurrently without sharing a transaction. Queries are
+    parameterized instead of formatting values into the SQL.
+    """
+
+    connection = None
+    local = threading.local()
+    # Every open cursor by the thread that owns it, so cursors of finished threads can be closed.
+    cursors = {}
+    lock = threading.Lock()
+
     schemas = [
         """
 		CREATE TABLE IF NOT EXISTS db.public.training (
@@ -87,29 +97,125 @@ class Database:
                 team_distribution VARCHAR,
                 batch_sizes VARCHAR
             );
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS db.public.garbage_collection (
+                run_id UUID,
+                generation INT,
+                teams INT,
+                programs INT,
+                PRIMARY KEY (run_id, generation)
+            );
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS db.public.team_rollups (
+                run_id UUID,
+                generation INT,
+                team_id UUID,
+                cumulative_reward FLOAT8,
+                episode_length INT,
+                terminated BOOLEAN,
+                rank INT,
+                PRIMARY KEY (run_id, generation, team_id)
+            );
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS db.public.generation_rollups (
+                run_id UUID,
+                generation INT,
+                num_teams INT,
+                min_fitness FLOAT8,
+                median_fitness FLOAT8,
+                mean_fitness FLOAT8,
+                max_fitness FLOAT8,
+                top_k_fitness FLOAT8,
+                mean_episode_length FLOAT8,
+                termination_rate FLOAT8,
+                PRIMARY KEY (run_id, generation)
+            );
         """
     ]
 
     @classmethod
     def connect(cls, user, password, host, port, database):
         try:
-            duckdb.sql("INSTALL postgres;")
-            duckdb.sql("LOAD postgres;")
-            duckdb.sql(f"ATTACH 'dbname={database} user={user} host={host} password={password}' AS db (TYPE POSTGRES);")
+            cls.connection = duckdb.connect()
+            cls.connection.execute("INSTALL postgres;")
+            cls.connection.execute("LOAD postgres;")
+            cls.connection.execute(
+                f"ATTACH 'dbname={database} user={user} host={host} port={port} password={password}' AS db (TYPE POSTGRES);")
 
             for schema in cls.schemas:
-                duckdb.sql(schema)
+                cls.connection.execute(schema)
 
         except (Exception, Error) as error:
             print("Error while connecting to database", error)
 
     @classmethod
     def disconnect(cls):
-        duckdb.sql("DETACH db;")
+        with cls.lock:
+            for cursor in cls.cursors.values():
+                cursor.close()
+            cls.cursors = {}
+            cls.local = threading.local()
+
+        cls.connection.execute("DETACH db;")
+        cls.connection.close()
+        cls.connection = None
+
+    @classmethod
+    def cursor(cls):
+        """
+        Return the calling thread's cursor, creating it on first use. Cursors left
+        behind by threads that have since finished are closed at the same time.
+        """
+        cursor = getattr(cls.local, 'cursor', None)
+
+        if cursor is None:
+            with cls.lock:
+                for thread in [thread for thread in cls.cursors if not thread.is_alive()]:
+                    cls.cursors.pop(thread).close()
+
+                cursor = cls.connection.cursor()
+                cls.cursors[threading.current_thread()] = cursor
+            cls.local.cursor = cursor
+
+        return cursor
+
+    @classmethod
+    def release_cursor(cls):
+        """
+        Close the calling thread's cursor. Threads that are done with the database can
+        call this instead of waiting for the next new cursor to reclaim it.
+        """
+        cursor = getattr(cls.local, 'cursor', None)
+
+        if cursor is not None:
+            with cls.lock:
+                cls.cursors.pop(threading.current_thread(), None)
+            cursor.close()
+            cls.local.cursor = None
+
+    @classmethod
+    def execute(cls, query, parameters=None):
+        return cls.cursor().execute(query, parameters)
+
+    @classmethod
+    def execute_frame(cls, query, frame, parameters=None):
+        """
+        Run a query over a DataFrame registered as `rows`. Registrations are scoped
+        to the thread's cursor, so concurrent bulk statements don't collide.
+        """
+        cursor = cls.cursor()
+        cursor.register('rows', frame)
+        try:
+            cursor.execute(query, parameters)
+        finally:
+            cursor.unregister('rows')
 
     @classmethod
     def clear(cls):
-        duckdb.sql("""
+        cls.execute("""
 		DROP TABLE IF EXISTS db.public.instructions;
 		DROP TABLE IF EXISTS db.public.programs;
 		DROP TABLE IF EXISTS db.public.teams;
@@ -119,251 +225,316 @@ class Database:
 		DROP TABLE IF EXISTS db.public.time_monitor;
 		DROP TABLE IF EXISTS db.public.diversity_cache;
 		DROP TABLE IF EXISTS db.public.compute_configs;
+		DROP TABLE IF EXISTS db.public.garbage_collection;
+		DROP TABLE IF EXISTS db.public.team_rollups;
+		DROP TABLE IF EXISTS db.public.generation_rollups;
 		""")
 
     @staticmethod
     def add_time_monitor_data(run_id, generation, time):
-        duckdb.sql(
-            f"INSERT INTO db.public.time_monitor (run_id, generation, time) VALUES ('{run_id}', {generation}, {time});")
+        Database.execute("INSERT INTO db.public.time_monitor (run_id, generation, time) VALUES (?, ?, ?);",
+                         [run_id, generation, time])
 
     @staticmethod
     def add_cpu_utilization_data(data):
-        for row in data:
-            run_id = row['run_id']
-            time = row['time']
-            worker = row['worker']
-            core = row['core']
-            utilization = row['utilization']
-            query = f"INSERT INTO db.public.cpu_utilization (run_id, time, worker, core, utilization) VALUES ('{run_id}', {time}, '{worker}', {core}, {utilization});"
-            duckdb.sql(query)
+        if not data:
+            return
+
+        Database.cursor().executemany(
+            "INSERT INTO db.public.cpu_utilization (run_id, time, worker, core, utilization) VALUES (?, ?, ?, ?, ?);",
+            [[row['run_id'], row['time'], row['worker'], row['core'], row['utilization']] for row in data])
 
     @staticmethod
     def add_training_data(data):
-        try:
-            # Create a temporary CSV file
-            with NamedTemporaryFile(mode='w', delete=False, suffix='.csv') as temp_file:
-                writer = csv.writer(temp_file)
-
-                # Write data rows to the CSV file
-                for row in data:
-                    writer.writerow([
-                        row['run_id'],
-                        row['generation'],
-                        row['team_id'],
-                        row['is_finished'],
-                        row['reward'],
-                        row['time_step'],
-                        row['time'],
-                        row['action']
-                    ])
-
-                temp_file_path = temp_file.name
-
-            # Use the COPY command to load data from the CSV file
-            duckdb.query(f"""
-                    COPY db.public.training FROM '{temp_file_path}' (FORMAT CSV);
-                """)
-
-            os.remove(temp_file_path)
-
-        except Exception as e:
-            # Handle any exceptions
-            print(f"An error occurred: {e}")
-            raise e
+        if not data:
+            return
+
+        frame = pd.DataFrame({
+            'run_id': [str(row['run_id']) for row in data],
+            'generation': [row['generation'] for row in data],
+            'team_id': [str(row['team_id']) for row in data],
+            'is_finished': [bool(row['is_finished']) for row in data],
+            'reward': [float(row['reward']) for row in data],
+            'time_step': [row['time_step'] for row in data],
+            'time': [row['time'] for row in data],
+            'action': [int(row['action']) for row in data]
+        })
+
+        Database.execute_frame("""
+            INSERT INTO db.public.training (run_id, generation, team_id, is_finished, reward, time_step, time, action)
+            SELECT run_id::UUID, generation, team_id::UUID, is_finished, reward, time_step, time, action FROM rows;
+        """, frame)
 
     @staticmethod
     def add_compute_config(run_id, team_distribution, batch_sizes):
-        query = f"INSERT INTO db.public.compute_configs VALUES ('{run_id}', '{team_distribution}', '{batch_sizes}');"
-        print(query)
-        duckdb.sql(query)
+        Database.execute("INSERT INTO db.public.compute_configs VALUES (?, ?, ?);",
+                         [run_id, str(team_distribution), str(batch_sizes)])
 
     @staticmethod
     def add_team(run_id, team):
-        duckdb.sql(f"INSERT INTO db.public.teams (run_id, id, lucky_breaks) VALUES ('{run_id}', '{team.id}', 0);")
+        Database.execute("INSERT INTO db.public.teams (run_id, id, lucky_breaks) VALUES (?, ?, 0);", [run_id, team.id])
 
     @staticmethod
     def remove_team(run_id, team):
-        duckdb.sql(f"DELETE FROM db.public.teams WHERE id = '{team.id}' AND run_id = '{run_id}';")
+        Database.execute("DELETE FROM db.public.teams WHERE id = ? AND run_id = ?;", [team.id, run_id])
 
     @staticmethod
     def remove_program(run_id, learner, team):
-        duckdb.sql(
-            f"DELETE FROM db.public.programs WHERE run_id = '{run_id}' AND id = '{learner.id}' AND team_id = '{team.id}';")
+        Database.execute("DELETE FROM db.public.programs WHERE run_id = ? AND id = ? AND team_id = ?;",
+                         [run_id, learner.id, team.id])
 
     @staticmethod
-    def remove_programs(run_id, removed_programs_and_teams):
-        duckdb.query("""
-        CREATE TEMPORARY TABLE temp_delete_ids (
-        program_id INT,
-        team_id INT
-        ); 
-        """)
-
-        values_clause = ', '.join(f"({program_id}, {team_id})" for program_id, team_id in removed_programs_and_teams)
-        insert_statement = f"""
-        INSERT INTO db.public.temp_delete_ids (program_id, team_id)
-        VALUES {values_clause};"""
-
-        duckdb.sql(f"""
-        DELETE p
-        FROM db.public.programs p
-        JOIN db.public.temp_delete_ids t ON p.id = t.program_id AND p.team_id = t.team_id
-        WHERE p.run_id = '{run_id}';
-        """)
-
-        duckdb.sql(f"""
-        DROP TEMPORARY TABLE temp_delete_ids;
-        """)
+    def apply_population_diff(run_id, diff):
+        """
+        Bring the teams and programs tables in line with the population in one transaction.
+        Changed rows are deleted and reinserted along with the new ones, so the whole diff
+        costs at most four bulk statements however many objects changed.
+        """
+        if diff.is_empty():
+            return
+
+        cursor = Database.cursor()
+        cursor.begin()
+        try:
+            stale_team_ids = diff.deleted_team_ids + [team_id for team_id, _ in diff.upserted_teams]
+            if stale_team_ids:
+                Database.execute_frame("""
+                DELETE FROM db.public.teams
+                WHERE run_id = ?
+                AND id IN (SELECT id::UUID FROM rows);
+                """, pd.DataFrame({'id': [str(team_id) for team_id in stale_team_ids]}), [run_id])
+
+            stale_program_keys = diff.deleted_program_keys + [(learner_id, team_id) for learner_id, team_id, _, _
+                                                              in diff.upserted_programs]
+            if stale_program_keys:
+                Database.execute_frame("""
+                DELETE FROM db.public.programs
+                WHERE run_id = ?
+                AND (id, team_id) IN (SELECT id::UUID, team_id::UUID FROM rows);
+                """, pd.DataFrame({
+                    'id': [str(learner_id) for learner_id, _ in stale_program_keys],
+                    'team_id': [str(team_id) for _, team_id in stale_program_keys]
+                }), [run_id])
+
+            if diff.upserted_teams:
+                Database.execute_frame("""
+                INSERT INTO db.public.teams (run_id, id, lucky_breaks)
+                SELECT ?, id::UUID, lucky_breaks FROM rows;
+                """, pd.DataFrame({
+                    'id': [str(team_id) for team_id, _ in diff.upserted_teams],
+                    'lucky_breaks': [lucky_breaks for _, lucky_breaks in diff.upserted_teams]
+                }), [run_id])
+
+            if diff.upserted_programs:
+                Database.execute_frame("""
+                INSERT INTO db.public.programs (run_id, id, team_id, action, pointer)
+                SELECT ?, id::UUID, team_id::UUID, action, pointer::UUID FROM rows;
+                """, pd.DataFrame({
+                    'id': [str(learner_id) for learner_id, _, _, _ in diff.upserted_programs],
+                    'team_id': [str(team_id) for _, team_id, _, _ in diff.upserted_programs],
+                    'action': pd.Series([action for _, _, action, _ in diff.upserted_programs], dtype=object),
+                    'pointer': pd.Series([str(pointer) if pointer else None
+                                          for _, _, _, pointer in diff.upserted_programs], dtype=object)
+                }), [run_id])
+
+            cursor.commit()
+        except Exception:
+            cursor.rollback()
+            raise
 
     @staticmethod
-    def remove_teams(run_id, removed_teams):
-        duckdb.query("""
-                    CREATE TEMPORARY TABLE temp_remove_teams (
-                        team_id UUID
-                    );
-                """)
-
-        # Prepare the VALUES clause for batch insertion
-        values_clause = ', '.join(f"('{team_id}')" for team_id in removed_teams)
-
-        # Form the complete INSERT statement
-        insert_statement = f"""
-                INSERT INTO db.public.temp_remove_teams (team_id)
-                VALUES {values_clause};
-                """
-
-        # Execute the INSERT statement
-        duckdb.query(insert_statement)
-
-        # Perform the batch DELETE operation
-        delete_statement = f"""
-                DELETE t
-                FROM db.public.teams t
-                JOIN db.public.temp_remove_teams r
-                ON t.id = r.team_id
-                WHERE t.run_id = '{run_id}';
-                """
-
-        # Execute the DELETE statement
-        duckdb.query(delete_statement)
-
-        # Drop the temporary table
-        duckdb.query("DROP TABLE temp_remove_teams;")
+    def add_garbage_collection_data(run_id, generation, teams, programs):
+        Database.execute("""
+        INSERT INTO db.public.garbage_collection (run_id, generation, teams, programs)
+        VALUES (?, ?, ?, ?);""", [run_id, generation, teams, programs])
 
     @staticmethod
     def add_program(run_id, program, team):
-        duckdb.sql(f"""
+        Database.execute("""
             INSERT INTO db.public.programs (run_id, id, team_id, action, pointer)
-            VALUES ('{run_id}', '{program.id}', '{team.id}', '{program.action}', NULL);""")
+            VALUES (?, ?, ?, ?, NULL);""", [run_id, program.id, team.id, str(program.action)])
 
     @staticmethod
     def update_program(run_id, program, team, action, pointer):
-        if not action:
-            action = "NULL"
-        else:
-            action = f"'{action}'"
-
-        if not pointer:
-            pointer = "NULL"
-        else:
-            pointer = f"'{pointer}'"
-
-        duckdb.sql(f"""
+        Database.execute("""
         UPDATE db.public.programs
         SET
-            action = {action},
-            pointer = {pointer}
-        WHERE run_id = '{run_id}'
-        AND id = '{program.id}'
-        AND team_id = '{team.id}'""")
+            action = ?,
+            pointer = ?
+        WHERE run_id = ?
+        AND id = ?
+        AND team_id = ?""", [str(action) if action else None, pointer if pointer else None,
+                             run_id, program.id, team.id])
 
     @staticmethod
     def get_teams(run_id):
-        return duckdb.sql(f"""SELECT * FROM db.public.teams WHERE run_id = '{run_id}'""")
+        return Database.execute("SELECT * FROM db.public.teams WHERE run_id = ?", [run_id]).df()
 
     @staticmethod
     def get_root_teams(run_id):
-        return duckdb.sql(f"""
+        return Database.execute("""
             WITH programs_pointing_to_teams AS (
                 SELECT pointer FROM db.public.programs 
                 WHERE pointer IS NOT NULL
-                AND run_id = '{run_id}'
+                AND run_id = $run_id
             )
 
             SELECT * FROM db.public.teams
             WHERE id NOT IN (SELECT pointer FROM programs_pointing_to_teams)
-            AND run_id = '{run_id}'
-            """).df()['id'].tolist()
+            AND run_id = $run_id
+            """, {'run_id': run_id}).df()['id'].tolist()
+
+    @staticmethod
+    def rollup(training_data, parameters=Parameters):
+        """
+        Summarize one generation of training rows into per-team and per-generation rollups.
+
+        Teams are ranked by cumulative reward, best first. The generation rollup holds
+        the fitness distribution and the mean fitness of the top ROLLUP_TOP_K teams.
+        """
+        teams = {}
+        for row in training_data:
+            team = teams.setdefault(row['team_id'], {
+                'team_id': row['team_id'],
+                'cumulative_reward': 0.0,
+                'episode_length': 0,
+                'terminated': False
+            })
+            team['cumulative_reward'] += row['reward']
+            if row['time_step'] >= team['episode_length']:
+                team['episode_length'] = row['time_step']
+                team['terminated'] = row.get('terminated', row['is_finished'])
+
+        team_rollups = sorted(teams.values(), key=lambda x: x['cumulative_reward'], reverse=True)
+        for rank, team in enumerate(team_rollups, start=1):
+            team['rank'] = rank
+
+        if not team_rollups:
+            return team_rollups, None
+
+        fitness = np.array([team['cumulative_reward'] for team in team_rollups])
+        generation_rollup = {
+            'num_teams': len(team_rollups),
+            'min_fitness': float(fitness.min()),
+            'median_fitness': float(np.median(fitness)),
+            'mean_fitness': float(fitness.mean()),
+            'max_fitness': float(fitness.max()),
+            'top_k_fitness': float(fitness[:parameters.ROLLUP_TOP_K].mean()),
+            'mean_episode_length': float(np.mean([team['episode_length'] for team in team_rollups])),
+            'termination_rate': float(np.mean([team['terminated'] for team in team_rollups]))
+        }
+
+        return team_rollups, generation_rollup
+
+    @staticmethod
+    def add_rollups(run_id, generation, training_data, parameters=Parameters):
+        """
+        Maintain the rollup tables from a generation's training rows as they are flushed,
+        so analysis queries never have to rescan the training table.
+        """
+        team_rollups, generation_rollup = Database.rollup(training_data, parameters)
+
+        if not team_rollups:
+            return
+
+        Database.cursor().executemany("""
+        INSERT INTO db.public.team_rollups
+        (run_id, generation, team_id, cumulative_reward, episode_length, terminated, rank)
+        VALUES (?, ?, ?, ?, ?, ?, ?);""", [
+            [run_id, generation, team['team_id'], team['cumulative_reward'], team['episode_length'],
+             bool(team['terminated']), team['rank']]
+            for team in team_rollups])
+
+        Database.execute("""
+        INSERT INTO db.public.generation_rollups
+        (run_id, generation, num_teams, min_fitness, median_fitness, mean_fitness, max_fitness, top_k_fitness,
+         mean_episode_length, termination_rate)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);""", [
+            run_id, generation, generation_rollup['num_teams'], generation_rollup['min_fitness'],
+            generation_rollup['median_fitness'], generation_rollup['mean_fitness'],
+            generation_rollup['max_fitness'], generation_rollup['top_k_fitness'],
+            generation_rollup['mean_episode_length'], generation_rollup['termination_rate']])
 
     @staticmethod
     def get_ranked_teams(run_id, generation):
-        return duckdb.sql(f"""
-                WITH team_cumulative_rewards AS (
-                  SELECT generation,
-                         team_id,
-                         SUM(reward) AS cumulative_reward
-                  FROM db.public.training
-                  WHERE generation = '{generation}'
-                  AND run_id = '{run_id}'
-                  GROUP BY generation, team_id
-				)
-
-				SELECT generation,
-			           team_id,
-					   cumulative_reward,
-					   ROW_NUMBER() OVER (PARTITION BY generation ORDER BY cumulative_reward DESC) AS rank
-				FROM team_cumulative_rewards
-				WHERE generation={generation}""").df()
+        return Database.execute("""
+                SELECT generation,
+                       team_id,
+                       cumulative_reward,
+                       rank
+                FROM db.public.team_rollups
+                WHERE generation = ?
+                AND run_id = ?""", [generation, run_id]).df()
+
+    @staticmethod
+    def get_top_teams(run_id, generation, k=Parameters.ROLLUP_TOP_K):
+        return Database.execute("""
+                SELECT * FROM db.public.team_rollups
+                WHERE generation = ?
+                AND run_id = ?
+                AND rank <= ?
+                ORDER BY rank""", [generation, run_id, k]).df()
+
+    @staticmethod
+    def get_learning_curve(run_id):
+        return Database.execute("""
+                SELECT * FROM db.public.generation_rollups
+                WHERE run_id = ?
+                ORDER BY generation""", [run_id]).df()
+
+    @staticmethod
+    def get_team_history(run_id, team_id):
+        return Database.execute("""
+                SELECT * FROM db.public.team_rollups
+                WHERE team_id = ?
+                AND run_id = ?
+                ORDER BY generation""", [team_id, run_id]).df()
 
     @staticmethod
     def update_team(run_id, team, lucky_breaks):
-        return duckdb.sql(f"""
-        UPDATE db.public.teams SET lucky_breaks = '{lucky_breaks}' 
-        WHERE id = '{team.id}'
-        AND run_id = '{run_id}';
-        """)
+        return Database.execute("""
+        UPDATE db.public.teams SET lucky_breaks = ?
+        WHERE id = ?
+        AND run_id = ?;
+        """, [lucky_breaks, team.id, run_id])
 
     @staticmethod
     def add_observation(run_id, time, observation):
-        observation = ', '.join(map(str, observation))
-
-        query = f"""
+        query = """
         INSERT INTO db.public.observations (run_id, time, observation)
-        VALUES ('{run_id}', {time}, ARRAY[{observation}])
+        VALUES (?, ?, ?)
        """
 
-        return duckdb.sql(query)
+        return Database.execute(query, [run_id, time, [float(x) for x in observation]])
 
     @staticmethod
     def add_profile(run_id, team, time, profile):
-        profile = ', '.join(map(str, profile))
-
-        query = f"""
+        query = """
         INSERT INTO db.public.diversity_cache (run_id, team_id, time, profile)
-        VALUES ('{run_id}', '{team.id}', {time}, ARRAY[{profile}])
+        VALUES (?, ?, ?, ?)
         """
 
-        return duckdb.sql(query)
+        return Database.execute(query, [run_id, team.id, time, [int(x) for x in profile]])
 
     @staticmethod
     def get_diversity_cache(run_id):
-        return duckdb.query(f"""
+        return Database.execute("""
         SELECT * FROM db.public.observations
-        WHERE run_id = '{run_id}'
+        WHERE run_id = ?
         ORDER BY time DESC
-        LIMIT {Parameters.DIVERSITY_CACHE_SIZE} 
-        """).df()['observation'].to_list()
+        LIMIT ?
+        """, [run_id, Parameters.DIVERSITY_CACHE_SIZE]).df()['observation'].to_list()
 
     @staticmethod
     def get_diversity_profiles(run_id):
         profiles = []
 
-        query_results = duckdb.query(f"""
+        query_results = Database.execute("""
             SELECT profile FROM db.public.diversity_cache
-            WHERE run_id = '{run_id}'
+            WHERE run_id = ?
             ORDER BY time DESC
-            LIMIT {Parameters.DIVERSITY_CACHE_SIZE}
-        """).df()['profile']
+            LIMIT ?
+        """, [run_id, Parameters.DIVERSITY_CACHE_SIZE]).df()['profile']
 
         for profile in query_results:
             if isinstance(profile, np.ndarray):
@@ -373,8 +544,8 @@ class Database:
         return profiles
 
     @staticmethod
-    def get_survivor_ids(run_id, generation):
-        survivor_count = math.floor(Parameters.POPGAP * Parameters.POPULATION_SIZE)
+    def get_survivor_ids(run_id, generation, parameters=Parameters):
+        survivor_count = math.floor(parameters.POPGAP * parameters.POPULATION_SIZE)
         sorted_team_ids = Database.get_ranked_teams(run_id, generation).sort_values('rank')['team_id']
         survivor_ids = sorted_team_ids[:survivor_count].to_list()
         return survivor_ids
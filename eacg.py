@@ -8,10 +8,128 @@ from parameters import Parameters
 from team import Team
 
 class EACG:
-    def __init__(self):
-        self.learnerPopulation = [Learner() for _ in range(Parameters.INITIAL_LEARNER_POPULATION_SIZE)]
-        self.teamPopulation = [Team(self.learnerPopulation) for _ in range(Parameters.POPULATION_SIZE)]
-        self.teamPopulation = []
+    def __init__(self, parameters=Parameters):
+        self.parameters = parameters
+        self.learnerPopulation = [Learner(parameters=parameters)
+                                  for _ in range(parameters.INITIAL_LEARNER_POPULATION_SIZE)]
+        self.teamPopulation = [Team(self.learnerPopulation, parameters) for _ in range(parameters.POPULATION_SIZE)]
+
+        # Learners that no initial team sampled are reclaimed straight away.
+        self.release_learners(self.learnerPopulation)
 
     def get_root_teams(self):
         return list(filter(lambda x: x.is_root_team(), self.teamPopulation))
+
+    def clone_team(self, team):
+        """
+        Clone a team with fresh ids for the team and its learners.
+
+        Teams the learners point to are shared with the original rather than copied,
+        and they gain a reference from each cloned pointer learner.
+        """
+        clone = team.clone()
+
+        for learner in clone.learners:
+            learner.referenced_by.add(clone.id)
+
+            if not learner.is_atomic():
+                learner.action.referenced_by.add(learner.id)
+
+        self.learnerPopulation.extend(clone.learners)
+
+        return clone
+
+    def release_teams(self, teams):
+        """
+        Remove teams from the population and reclaim whatever only they kept alive.
+
+        A learner whose last referencing team is released is reclaimed. If it pointed at
+        a team, that team loses the reference, and once nothing references it the team
+        is released too. Returns the ids of the reclaimed teams and learners.
+        """
+        return self._release(teams, [])
+
+    def release_learners(self, learners):
+        """
+        Reclaim those of the given learners that no team references any more, e.g. after
+        a mutation removed them from their last team. The teams they pointed at are
+        released the same way as in release_teams.
+        """
+        return self._release([], learners)
+
+    def _release(self, teams, learners):
+        removed_team_ids, removed_learner_ids = set(), set()
+        pending_teams, pending_learners = list(teams), list(learners)
+
+        while pending_teams or pending_learners:
+            if pending_learners:
+                learner = pending_learners.pop()
+                if learner.referenced_by or learner.id in removed_learner_ids:
+                    continue
+                removed_learner_ids.add(learner.id)
+
+                if not learner.is_atomic():
+                    pointed_team = learner.action
+                    pointed_team.referenced_by.discard(learner.id)
+                    if not pointed_team.referenced_by:
+                        pending_teams.append(pointed_team)
+                continue
+
+            team = pending_teams.pop()
+            if team.id in removed_team_ids:
+                continue
+            removed_team_ids.add(team.id)
+
+            for learner in team.learners:
+                learner.referenced_by.discard(team.id)
+                pending_learners.append(learner)
+
+        self._remove(removed_team_ids, removed_learner_ids)
+
+        return removed_team_ids, removed_learner_ids
+
+    def collect_garbage(self):
+        """
+        Mark every team and learner reachable from the root teams and sweep the rest.
+
+        This reclaims what reference counting can't: cycles of teams pointing at each other
+        and teams kept alive by stale references. References to reclaimed objects are
+        dropped from the survivors. Returns the ids of the reclaimed teams and learners.
+        """
+        live_teams, live_learners = {}, {}
+        pending = self.get_root_teams()
+
+        while pending:
+            team = pending.pop()
+            if team.id in live_teams:
+                continue
+            live_teams[team.id] = team
+
+            for learner in team.learners:
+                if learner.id in live_learners:
+                    continue
+                live_learners[learner.id] = learner
+
+                if not learner.is_atomic():
+                    pending.append(learner.action)
+
+        removed_team_ids = {team.id for team in self.teamPopulation if team.id not in live_teams}
+        removed_learner_ids = {learner.id for learner in self.learnerPopulation if learner.id not in live_learners}
+
+        # Intersecting with a dict would iterate the whole dict for every set, so use key sets.
+        live_team_ids, live_learner_ids = set(live_teams), set(live_learners)
+        for team in live_teams.values():
+            team.referenced_by.intersection_update(live_learner_ids)
+        for learner in live_learners.values():
+            learner.referenced_by.intersection_update(live_team_ids)
+
+        self._remove(removed_team_ids, removed_learner_ids)
+
+        return removed_team_ids, removed_learner_ids
+
+    def _remove(self, team_ids, learner_ids):
+        # The populations are rebuilt instead of removing elements one at a time.
+        if team_ids:
+            self.teamPopulation = [team for team in self.teamPopulation if team.id not in team_ids]
+        if learner_ids:
+            self.learnerPopulation = [learner for learner in self.learnerPopulation if learner.id not in learner_ids]
@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from checkpoint import Checkpoint
+from parameters import Parameters
+
+
+class PolicyGraph:
+    """
+    A frozen copy of a root team's policy graph for batched inference.
+
+    The weights of each team's learners are stacked so that all of a team's bids for
+    a whole batch of observations are one einsum. Action selection follows
+    Team.get_action: the highest bidder that hasn't been visited yet wins, and
+    pointers delegate to the team they point at.
+    """
+
+    def __init__(self, root_team):
+        # The policy is served with the parameters and precision of the run that trained it.
+        learner = root_team.learners[0]
+        self.dtype = learner.neuralnet.dtype
+        self.num_observations = learner.parameters.NUM_OBSERVATIONS
+        self.teams = []
+        self.learner_ids = {}
+
+        team_indices = {}
+        pending = [root_team]
+        while pending:
+            team = pending.pop()
+            if team.id in team_indices:
+                continue
+            team_indices[team.id] = len(self.teams)
+            self.teams.append(team)
+            pending.extend(learner.action for learner in team.learners if not learner.is_atomic())
+
+        self.stacked = []
+        for team in self.teams:
+            networks = [learner.neuralnet for learner in team.learners]
+            self.stacked.append({
+                'input_weights': np.stack([n.input_weights for n in networks]).astype(self.dtype),
+                'bias1': np.stack([n.bias1 for n in networks]).astype(self.dtype),
+                'hidden_weights': np.stack([n.hidden_weights[:, 0] for n in networks]).astype(self.dtype),
+                'bias2': np.array([n.bias2 for n in networks], dtype=self.dtype),
+                'learners': [self.learner_ids.setdefault(learner.id, len(self.learner_ids))
+                             for learner in team.learners],
+                'atomic': [learner.is_atomic() for learner in team.learners],
+                'targets': [learner.action if learner.is_atomic() else team_indices[learner.action.id]
+                            for learner in team.learners]
+            })
+
+    def bids(self, team_index, observations):
+        team = self.stacked[team_index]
+        hidden = np.einsum('bo,loh->blh', observations, team['input_weights']) + team['bias1']
+        np.maximum(hidden, 0, out=hidden)
+        return np.einsum('blh,lh->bl', hidden, team['hidden_weights']) + team['bias2']
+
+    def act(self, observations):
+        num_requests = len(observations)
+        observations = np.asarray(observations, dtype=self.dtype)
+        assert observations.shape == (num_requests, self.num_observations), \
+            f"Expected {num_requests} observations of size {self.num_observations}, got shape {observations.shape}"
+
+        actions = np.empty(len(observations), dtype=np.int64)
+        visited = [set() for _ in range(len(observations))]
+
+        pending = [(0, np.arange(len(observations)))]
+        while pending:
+            team_index, rows = pending.pop()
+            team = self.stacked[team_index]
+
+            # A stable sort on the negated bids breaks ties the same way sorted(..., reverse=True) does.
+            order = np.argsort(-self.bids(team_index, observations[rows]), axis=1, kind='stable')
+
+            winners = {}
+            for row, ranking in zip(rows, order):
+                for position in ranking:
+                    learner = team['learners'][position]
+                    if learner not in visited[row]:
+                        visited[row].add(learner)
+                        winners.setdefault(position, []).append(row)
+                        break
+                else:
+                    raise RuntimeError("No atomic action found, but one was expected.")
+
+            for position, winner_rows in winners.items():
+                if team['atomic'][position]:
+                    actions[winner_rows] = team['targets'][position]
+                else:
+                    pending.append((team['targets'][position], np.array(winner_rows)))
+
+        return actions
+
+
+class LatencyStats:
+    """
+    Collects request latencies and reports throughput and percentiles.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.latencies = []
+        self.batch_sizes = []
+        self.start = time.perf_counter()
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        latencies = np.array(self.latencies) * 1000
+        summary = {'requests': len(latencies), 'throughput': len(latencies) / elapsed if elapsed > 0 else 0.0}
+
+        if len(latencies):
+            summary.update({
+                'mean_ms': float(latencies.mean()),
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p95_ms': float(np.percentile(latencies, 95)),
+                'p99_ms': float(np.percentile(latencies, 99))
+            })
+        if self.batch_sizes:
+            summary['mean_batch_size'] = float(np.mean(self.batch_sizes))
+
+        return summary
+
+    def report(self, name):
+        summary = self.summary()
+        line = f"[{name}] {summary['requests']} requests, {summary['throughput']:.0f} req/s"
+        if 'mean_ms' in summary:
+            line += (f", latency mean {summary['mean_ms']:.2f} ms, p50 {summary['p50_ms']:.2f} ms, "
+                     f"p95 {summary['p95_ms']:.2f} ms, p99 {summary['p99_ms']:.2f} ms")
+        if 'mean_batch_size' in summary:
+            line += f", mean batch {summary['mean_batch_size']:.1f}"
+        print(line)
+
+
+class InferenceServer:
+    """
+    Serves a policy over a local socket. Each connection sends one JSON object per line,
+    {"observation": [...]}, and gets back {"action": ...} per line in the same order.
+
+    Requests that arrive within `batch_window` seconds of the first waiting request are
+    answered together with one batched pass over the policy graph.
+    """
+
+    def __init__(self, policy, host=Parameters.INFERENCE_HOST, port=Parameters.INFERENCE_PORT,
+                 batch_window=Parameters.INFERENCE_BATCH_WINDOW, max_batch_size=Parameters.INFERENCE_MAX_BATCH_SIZE,
+                 report_interval=Parameters.INFERENCE_REPORT_INTERVAL):
+        self.policy = policy
+        self.host = host
+        self.port = port
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.report_interval = report_interval
+        self.stats = LatencyStats()
+        self.queue = None
+
+    def parse_request(self, line):
+        """
+        Return the observation of a request line, or raise ValueError if it isn't one
+        observation of the policy's size. Bad requests are rejected on their own so they
+        never reach a batch shared with other clients.
+        """
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as error:
+            raise ValueError(f"Invalid JSON: {error}")
+
+        if not isinstance(request, dict) or not isinstance(request.get('observation'), list):
+            raise ValueError("Expected {\"observation\": [...]}")
+
+        observation = request['observation']
+        if len(observation) != self.policy.num_observations:
+            raise ValueError(f"Expected an observation of size {self.policy.num_observations}, "
+                             f"got {len(observation)}")
+        if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in observation):
+            raise ValueError("Observations must be numbers")
+
+        return observation
+
+    async def handle_client(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while line := await reader.readline():
+                try:
+                    observation = self.parse_request(line)
+                except ValueError as error:
+                    response = {'error': str(error)}
+                else:
+                    future = loop.create_future()
+                    await self.queue.put((time.perf_counter(), observation, future))
+
+                    try:
+                        response = {'action': int(await future)}
+                    except Exception as error:
+                        response = {'error': str(error)}
+
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def batcher(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                actions = self.policy.act([observation for _, observation, _ in batch])
+            except Exception as error:
+                for _, _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            now = time.perf_counter()
+            for (received, _, future), action in zip(batch, actions):
+                future.set_result(action)
+                self.stats.latencies.append(now - received)
+            self.stats.batch_sizes.append(len(batch))
+
+    async def reporter(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.stats.report('server')
+            self.stats.reset()
+
+    async def serve(self):
+        self.queue = asyncio.Queue()
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        print(f"Serving on {self.host}:{self.port}")
+
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.batcher(), self.reporter())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve a checkpointed root team.")
+    parser.add_argument('checkpoint')
+    parser.add_argument('--host', default=Parameters.INFERENCE_HOST)
+    parser.add_argument('--port', type=int, default=Parameters.INFERENCE_PORT)
+    parser.add_argument('--batch-window', type=float, default=Parameters.INFERENCE_BATCH_WINDOW)
+    parser.add_argument('--max-batch-size', type=int, default=Parameters.INFERENCE_MAX_BATCH_SIZE)
+    parser.add_argument('--precision', choices=['float32', 'float64'], default=None,
+                        help="Serve in this precision instead of the one the checkpoint was saved in.")
+    args = parser.parse_args()
+
+    policy = PolicyGraph(Checkpoint.load(args.checkpoint, args.precision))
+    server = InferenceServer(policy, args.host, args.port, args.batch_window, args.max_batch_size)
+    asyncio.run(server.serve())
@@ -7,18 +7,36 @@ from parameters import Parameters
 
 class Learner:
 
-    def __init__(self):
+    def __init__(self, seed=None, parameters=Parameters):
         self.id = uuid4()
-        self.neuralnet = NeuralNet()
-        self.action = random.choice(Parameters.ACTIONS)
-        self.referenced_by = []
+        self.parameters = parameters
+        self.neuralnet = NeuralNet(seed, parameters)
+
+        if seed is None:
+            self.action = random.choice(parameters.ACTIONS)
+        else:
+            self.action = parameters.ACTIONS[self.neuralnet.rng.integers(len(parameters.ACTIONS))]
+        self.referenced_by = set()
+
+    def clone(self):
+        """
+        A new learner with a fresh id, a copy of this learner's network and the same
+        action. A pointer keeps pointing at the same team. The clone starts unreferenced.
+        """
+        clone = Learner.__new__(Learner)
+        clone.id = uuid4()
+        clone.parameters = self.parameters
+        clone.neuralnet = self.neuralnet.clone()
+        clone.action = self.action
+        clone.referenced_by = set()
+        return clone
 
     def bid(self, observation):
         prediction, _ = self.neuralnet.forward(observation)
         return prediction
 
     def is_atomic(self):
-        return self.action in Parameters.ACTIONS
+        return self.action in self.parameters.ACTIONS
 
     def train(self, previous_state, reward, next_state):
         self.neuralnet.backward(previous_state, reward, next_state)
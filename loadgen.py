@@ -0,0 +1,59 @@
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from inference import LatencyStats
+from parameters import Parameters
+
+
+async def client(host, port, deadline, stats, seed, num_observations):
+    rng = np.random.default_rng(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        while time.perf_counter() < deadline:
+            observation = rng.normal(0, 1, num_observations).tolist()
+
+            start = time.perf_counter()
+            writer.write(json.dumps({'observation': observation}).encode() + b'\n')
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            stats.latencies.append(time.perf_counter() - start)
+
+            if 'error' in response:
+                raise RuntimeError(response['error'])
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def generate_load(host, port, connections, duration, num_observations=Parameters.NUM_OBSERVATIONS):
+    """
+    Keep `connections` clients sending requests back to back for `duration` seconds,
+    then report the client-side latency and throughput. Observations must have the size
+    the served checkpoint was trained on.
+    """
+    stats = LatencyStats()
+    deadline = time.perf_counter() + duration
+
+    await asyncio.gather(*(client(host, port, deadline, stats, seed, num_observations)
+                           for seed in range(connections)))
+
+    stats.report(f'load generator, {connections} connections')
+    return stats.summary()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Send observations to an inference server on localhost.")
+    parser.add_argument('--host', default=Parameters.INFERENCE_HOST)
+    parser.add_argument('--port', type=int, default=Parameters.INFERENCE_PORT)
+    parser.add_argument('--connections', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--num-observations', type=int, default=Parameters.NUM_OBSERVATIONS,
+                        help="Observation size of the served checkpoint, e.g. 4 for CartPole-v1.")
+    args = parser.parse_args()
+
+    asyncio.run(generate_load(args.host, args.port, args.connections, args.duration, args.num_observations))
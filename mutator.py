@@ -1,28 +1,29 @@
 import random
 
+import numpy as np
+
 from learner import Learner
-from parameters import Parameters
 
 
 class Mutator:
     @staticmethod
     def mutateLearner(learner):
-        if random.random() < Parameters.ADD_NOISE_PROBABILITY:
-            learner.add_noise(Parameters.NOISE_AMOUNT)
+        if random.random() < learner.parameters.ADD_NOISE_PROBABILITY:
+            learner.add_noise(learner.parameters.NOISE_AMOUNT)
 
     @staticmethod
     def mutateTeam(tnng, team):
         ids = [learner.id for learner in team.learners]
 
-        if random.random() < Parameters.ADD_LEARNER_PROBABILITY:
-            if len(team.learners) < Parameters.MAX_LEARNER_COUNT:
+        if random.random() < tnng.parameters.ADD_LEARNER_PROBABILITY:
+            if len(team.learners) < tnng.parameters.MAX_LEARNER_COUNT:
                 newLearner = random.choice(tnng.learnerPopulation)
                 while newLearner.id in ids:
                     newLearner = random.choice(tnng.learnerPopulation)
-                newLearner.referenced_by.append(team.id)
+                newLearner.referenced_by.add(team.id)
                 team.learners.append(newLearner)
 
-        if random.random() < Parameters.REMOVE_LEARNER_PROBABILITY:
+        if random.random() < tnng.parameters.REMOVE_LEARNER_PROBABILITY:
             # Collect distinct atomic actions
             distinct_atomic_actions = set(learner.action for learner in team.learners if learner.is_atomic())
 
@@ -40,14 +41,18 @@ class Mutator:
 
                     if len(remaining_actions) >= 2:
                         team.learners.remove(removed_learner)
+                        removed_learner.referenced_by.discard(team.id)
+                        tnng.release_learners([removed_learner])
                 else:
                     # Safe to remove non-atomic learners
                     team.learners.remove(removed_learner)
+                    removed_learner.referenced_by.discard(team.id)
+                    tnng.release_learners([removed_learner])
 
-        if random.random() < Parameters.NEW_LEARNER_PROBABILITY:
-            if len(team.learners) < Parameters.MAX_LEARNER_COUNT:
-                learner = Learner()
-                learner.referenced_by.append(team.id)
+        if random.random() < tnng.parameters.NEW_LEARNER_PROBABILITY:
+            if len(team.learners) < tnng.parameters.MAX_LEARNER_COUNT:
+                learner = Learner(parameters=tnng.parameters)
+                learner.referenced_by.add(team.id)
                 tnng.learnerPopulation.append(learner)
                 team.learners.append(learner)
 
@@ -56,7 +61,7 @@ class Mutator:
         for learner in team.learners:
             Mutator.mutateLearner(learner)
 
-        if random.random() < Parameters.POINTER_PROBABILITY:
+        if random.random() < tnng.parameters.POINTER_PROBABILITY:
             distinct_atomic_actions = set(learner.action for learner in team.learners if learner.is_atomic())
 
             if len(distinct_atomic_actions) >= 2:
@@ -71,9 +76,127 @@ class Mutator:
                     if len(remaining_actions) >= 2:
                         pointed_team = random.choice(tnng.teamPopulation)
                         learner.action = pointed_team
-                        pointed_team.referenced_by.append(learner.id)
+                        pointed_team.referenced_by.add(learner.id)
 
                 else:
+                    learner.action.referenced_by.discard(learner.id)
                     pointed_team = random.choice(tnng.teamPopulation)
                     learner.action = pointed_team
-                    pointed_team.referenced_by.append(learner.id)
+                    pointed_team.referenced_by.add(learner.id)
+
+    @staticmethod
+    def mutateCohort(tnng, cohort, rng):
+        """
+        Mutate a whole cohort of offspring at once.
+
+        Every Bernoulli decision, every random pick and every noise tensor for the cohort
+        is drawn from `rng` in a handful of vectorized calls, so the result is reproducible
+        from a single seed. Distinct learners are chosen without rejection sampling.
+
+        Learners removed from their last team are reclaimed once the cohort is mutated.
+        Returns the ids of the reclaimed teams and learners.
+        """
+        if not cohort:
+            return set(), set()
+
+        probabilities = np.array([tnng.parameters.ADD_LEARNER_PROBABILITY,
+                                  tnng.parameters.REMOVE_LEARNER_PROBABILITY,
+                                  tnng.parameters.NEW_LEARNER_PROBABILITY,
+                                  tnng.parameters.POINTER_PROBABILITY])
+        decisions = rng.random((len(cohort), len(probabilities))) < probabilities
+
+        # Uniform draws that are scaled into indices once the size of each list is known:
+        # the learner to add, the learner to remove, the learner to repoint and the team it points to.
+        picks = rng.random((len(cohort), 4))
+
+        # Seeds for any new learners, so that their weights and actions follow from `rng` as well.
+        seeds = rng.integers(2 ** 63, size=len(cohort))
+
+        population = tnng.learnerPopulation
+        population_index = {learner.id: i for i, learner in enumerate(population)}
+        # Removed learners are only reclaimed at the end, since the indices above must stay valid
+        # and a later mutation in the cohort may add them back to a team.
+        removed_learners = []
+
+        for team, (add, remove, new, pointer), (add_pick, remove_pick, pointer_pick, team_pick), seed \
+                in zip(cohort, decisions, picks, seeds):
+
+            if add and len(team.learners) < tnng.parameters.MAX_LEARNER_COUNT:
+                # Pick uniformly among the population learners not already on the team by
+                # drawing from the reduced range and stepping over the excluded indices.
+                excluded = sorted(population_index[learner.id] for learner in team.learners
+                                  if learner.id in population_index)
+                num_candidates = len(population) - len(excluded)
+
+                if num_candidates > 0:
+                    choice = int(add_pick * num_candidates)
+                    for index in excluded:
+                        if index > choice:
+                            break
+                        choice += 1
+
+                    newLearner = population[choice]
+                    newLearner.referenced_by.add(team.id)
+                    team.learners.append(newLearner)
+
+            if remove:
+                distinct_atomic_actions = set(learner.action for learner in team.learners if learner.is_atomic())
+
+                # Ensure that at least 2 distinct atomic actions are always present
+                if len(distinct_atomic_actions) > 2:
+                    removed_learner = team.learners[int(remove_pick * len(team.learners))]
+
+                    remaining_actions = set(
+                        learner.action for learner in team.learners if learner.is_atomic() and learner is not removed_learner
+                    )
+
+                    if not removed_learner.is_atomic() or len(remaining_actions) >= 2:
+                        team.learners.remove(removed_learner)
+                        removed_learner.referenced_by.discard(team.id)
+                        removed_learners.append(removed_learner)
+
+            if new and len(team.learners) < tnng.parameters.MAX_LEARNER_COUNT:
+                learner = Learner(seed, tnng.parameters)
+                learner.referenced_by.add(team.id)
+                population_index[learner.id] = len(population)
+                population.append(learner)
+                team.learners.append(learner)
+
+            if pointer:
+                learner = team.learners[int(pointer_pick * len(team.learners))]
+                distinct_atomic_actions = set(other.action for other in team.learners if other.is_atomic())
+
+                if len(distinct_atomic_actions) >= 2:
+                    remaining_actions = set(
+                        other.action for other in team.learners if other.is_atomic() and other is not learner
+                    )
+
+                    if not learner.is_atomic() or len(remaining_actions) >= 2:
+                        if not learner.is_atomic():
+                            learner.action.referenced_by.discard(learner.id)
+                        pointed_team = tnng.teamPopulation[int(team_pick * len(tnng.teamPopulation))]
+                        learner.action = pointed_team
+                        pointed_team.referenced_by.add(learner.id)
+
+        removed_ids = tnng.release_learners(removed_learners)
+
+        # Noise is sampled for every mutated learner in the cohort in one draw per weight tensor.
+        learners = [learner for team in cohort for learner in team.learners]
+        mutated = [learner for learner, selected in
+                   zip(learners, rng.random(len(learners)) < tnng.parameters.ADD_NOISE_PROBABILITY) if selected]
+
+        if not mutated:
+            return removed_ids
+
+        network = mutated[0].neuralnet
+        std = tnng.parameters.NOISE_AMOUNT
+        dtype = network.dtype
+        input_noise = std * rng.standard_normal((len(mutated),) + network.input_weights.shape, dtype=dtype)
+        bias1_noise = std * rng.standard_normal((len(mutated),) + network.bias1.shape, dtype=dtype)
+        hidden_noise = std * rng.standard_normal((len(mutated),) + network.hidden_weights.shape, dtype=dtype)
+        bias2_noise = std * rng.standard_normal(len(mutated), dtype=dtype)
+
+        for i, learner in enumerate(mutated):
+            learner.neuralnet.apply_noise(input_noise[i], bias1_noise[i], hidden_noise[i], bias2_noise[i])
+
+        return removed_ids
@@ -9,19 +9,49 @@ class NeuralNet:
 
     @staticmethod
     def relu_derivative(x):
-        return np.where(x > 0, 1, 0)
+        # Kept in the dtype of x so that float32 networks don't get promoted to float64.
+        return (x > 0).astype(x.dtype)
 
-    def __init__(self):
-        self.rng = np.random.default_rng()
+    def __init__(self, seed=None, parameters=Parameters):
+        self.parameters = parameters
+        self.rng = np.random.default_rng(seed)
+        self.dtype = np.dtype(parameters.PRECISION)
         self.input_weights = self.rng.normal(0, 1,
-                                             size=(Parameters.NUM_OBSERVATIONS, Parameters.NUM_HIDDEN_LAYER_NEURONS))
-        self.bias1 = self.rng.normal(0, 1, size=Parameters.NUM_HIDDEN_LAYER_NEURONS)
-        self.hidden_weights = self.rng.normal(0, 1, size=(Parameters.NUM_HIDDEN_LAYER_NEURONS, 1))
-        self.bias2 = self.rng.normal(0, 1)
+                                             size=(parameters.NUM_OBSERVATIONS, parameters.NUM_HIDDEN_LAYER_NEURONS)
+                                             ).astype(self.dtype)
+        self.bias1 = self.rng.normal(0, 1, size=parameters.NUM_HIDDEN_LAYER_NEURONS).astype(self.dtype)
+        self.hidden_weights = self.rng.normal(0, 1, size=(parameters.NUM_HIDDEN_LAYER_NEURONS, 1)).astype(self.dtype)
+        # A 0-d array rather than a scalar so that in-place updates keep the dtype.
+        self.bias2 = np.asarray(self.rng.normal(0, 1), dtype=self.dtype)
+
+    def clone(self):
+        """
+        Copy the weights and biases into a new network. The parameters and the random
+        generator are shared with the original rather than copied.
+        """
+        clone = NeuralNet.__new__(NeuralNet)
+        clone.parameters = self.parameters
+        clone.rng = self.rng
+        clone.dtype = self.dtype
+        clone.input_weights = self.input_weights.copy()
+        clone.bias1 = self.bias1.copy()
+        clone.hidden_weights = self.hidden_weights.copy()
+        clone.bias2 = self.bias2.copy()
+        return clone
+
+    def astype(self, dtype):
+        """Convert the weights and biases to another precision in place."""
+        self.dtype = np.dtype(dtype)
+        self.input_weights = self.input_weights.astype(self.dtype)
+        self.bias1 = self.bias1.astype(self.dtype)
+        self.hidden_weights = self.hidden_weights.astype(self.dtype)
+        self.bias2 = np.asarray(self.bias2, dtype=self.dtype)
+        return self
 
     def forward(self, observation):
-        assert len(observation) == Parameters.NUM_OBSERVATIONS, ("The observation provided does not match the "
+        assert len(observation) == self.parameters.NUM_OBSERVATIONS, ("The observation provided does not match the "
                                                                  "expected observation")
+        observation = np.asarray(observation, dtype=self.dtype)
         inputs_to_hidden_layer = np.dot(self.input_weights.T, observation) + self.bias1
         hidden_layer_activations = self.relu(inputs_to_hidden_layer)
 
@@ -29,10 +59,11 @@ class NeuralNet:
         return prediction[0], hidden_layer_activations
 
     def backward(self, state, reward, next_state):
+        state = np.asarray(state, dtype=self.dtype)
         V_current, hidden_activations_current = self.forward(state)
         V_next, _ = self.forward(next_state)
 
-        error = reward + (Parameters.DISCOUNT_RATE * V_next) - V_current
+        error = self.dtype.type(reward + (self.parameters.DISCOUNT_RATE * V_next) - V_current)
         delta_hidden_weights = error * hidden_activations_current
         delta_bias2 = error
 
@@ -40,14 +71,21 @@ class NeuralNet:
         delta_input_weights = np.outer(state, delta_hidden_input_weights * error)
         delta_bias1 = delta_hidden_input_weights * error
 
-        self.hidden_weights += Parameters.LEARNING_RATE * delta_hidden_weights.reshape(-1, 1)
-        self.bias2 += Parameters.LEARNING_RATE * delta_bias2
-        self.input_weights += Parameters.LEARNING_RATE * delta_input_weights
-        self.bias1 += Parameters.LEARNING_RATE * delta_bias1.flatten()
+        self.hidden_weights += self.parameters.LEARNING_RATE * delta_hidden_weights.reshape(-1, 1)
+        self.bias2 += self.parameters.LEARNING_RATE * delta_bias2
+        self.input_weights += self.parameters.LEARNING_RATE * delta_input_weights
+        self.bias1 += self.parameters.LEARNING_RATE * delta_bias1.flatten()
 
     def add_noise(self, noise_std=0.01):
         """Add Gaussian noise to the weights and biases."""
-        self.input_weights += self.rng.normal(0, noise_std, self.input_weights.shape)
-        self.bias1 += self.rng.normal(0, noise_std, self.bias1.shape)
-        self.hidden_weights += self.rng.normal(0, noise_std, self.hidden_weights.shape)
-        self.bias2 += self.rng.normal(0, noise_std)
+        self.apply_noise(noise_std * self.rng.standard_normal(self.input_weights.shape, dtype=self.dtype),
+                         noise_std * self.rng.standard_normal(self.bias1.shape, dtype=self.dtype),
+                         noise_std * self.rng.standard_normal(self.hidden_weights.shape, dtype=self.dtype),
+                         noise_std * self.rng.standard_normal(dtype=self.dtype))
+
+    def apply_noise(self, input_noise, bias1_noise, hidden_noise, bias2_noise):
+        """Add noise that was sampled elsewhere, e.g. for a whole cohort at once."""
+        self.input_weights += input_noise
+        self.bias1 += bias1_noise
+        self.hidden_weights += hidden_noise
+        self.bias2 += bias2_noise
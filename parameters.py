@@ -26,3 +26,50 @@ class Parameters:
     DISCOUNT_RATE = 0.98
     LEARNING_RATE = 0.001
     MAX_INITIAL_TEAM_SIZE = 5
+
+    RECORD_TRAJECTORIES = False
+    TRAJECTORY_DIRECTORY = 'trajectories'
+    TRAJECTORY_CHUNK_SIZE = 4096
+    TRAJECTORY_EVERY_NTH_TEAM = 1
+    TRAJECTORY_EVERY_NTH_GENERATION = 1
+    TRAJECTORY_TOP_K = None
+
+    MUTATION_SEED = None
+
+    GARBAGE_COLLECTION_INTERVAL = 10
+
+    # Precision of the network weights, activations and TD updates. 'float32' halves
+    # the memory of the population and matches the observations gymnasium returns.
+    PRECISION = 'float64'
+
+    ROLLUP_TOP_K = 5
+
+    CHECKPOINT_DIRECTORY = 'checkpoints'
+    CHECKPOINT_INTERVAL = 10
+    INFERENCE_HOST = '127.0.0.1'
+    INFERENCE_PORT = 8765
+    INFERENCE_BATCH_WINDOW = 0.002
+    INFERENCE_MAX_BATCH_SIZE = 256
+    INFERENCE_REPORT_INTERVAL = 5.0
+
+    # 'gymnasium' runs one gymnasium env per team with rendering. 'numpy' steps every
+    # team's episode together on the built-in batched CartPole (CartPole-v1 only).
+    ENVIRONMENT_BACKEND = 'gymnasium'
+
+    def __init__(self, **overrides):
+        """
+        A per-run set of parameters. Anything not overridden falls back to the class
+        defaults, so the Parameters class itself can still be passed wherever a
+        parameters object is expected.
+        """
+        for name, value in overrides.items():
+            if not hasattr(Parameters, name):
+                raise AttributeError(f"Unknown parameter {name}")
+            setattr(self, name, value)
+
+    def __deepcopy__(self, memo):
+        # Every object of a run shares the run's parameters, clones included.
+        return self
+
+    def __repr__(self):
+        return f"Parameters({', '.join(f'{name}={value!r}' for name, value in vars(self).items())})"
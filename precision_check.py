@@ -0,0 +1,67 @@
+import copy
+
+import numpy as np
+
+from learner import Learner
+from parameters import Parameters
+
+
+def check_precision(num_learners=1000, num_observations=1000, num_updates=200, team_size=5, seed=0):
+    """
+    Compare the bids of float64 learners against float32 copies of the same learners.
+
+    The learners are trained on the same sequence of TD updates in both precisions.
+    Bids must agree to within float32 rounding, and the highest bidder of every team
+    must agree unless its lead over the runner-up is itself within rounding.
+    """
+    rng = np.random.default_rng(seed)
+
+    parameters = Parameters(PRECISION='float64')
+    learners64 = [Learner(seed + i, parameters) for i in range(num_learners)]
+
+    learners32 = copy.deepcopy(learners64)
+    for learner in learners32:
+        learner.neuralnet.astype(np.float32)
+
+    # Observations arrive from gymnasium as float32, so both precisions see identical inputs.
+    states = rng.normal(0, 1, size=(num_updates + 1, Parameters.NUM_OBSERVATIONS)).astype(np.float32)
+    rewards = rng.normal(0, 1, size=num_updates)
+    for learner64, learner32 in zip(learners64, learners32):
+        for previous_state, reward, next_state in zip(states[:-1], rewards, states[1:]):
+            learner64.train(previous_state, reward, next_state)
+            learner32.train(previous_state, reward, next_state)
+
+    observations = rng.normal(0, 1, size=(num_observations, Parameters.NUM_OBSERVATIONS)).astype(np.float32)
+    bids64 = np.array([[learner.bid(observation) for observation in observations] for learner in learners64])
+    bids32 = np.array([[learner.bid(observation) for observation in observations] for learner in learners32])
+
+    assert bids32.dtype == np.float32, "float32 learners should bid in float32"
+
+    scale = np.abs(bids64).max()
+    bid_error = np.abs(bids64 - bids32.astype(np.float64)).max() / scale
+    tolerance = 1e-4
+
+    # Group the learners into teams and compare the winning bidder for every observation.
+    teams = rng.permutation(num_learners)[:num_learners - num_learners % team_size].reshape(-1, team_size)
+    team_bids64 = bids64[teams]
+    team_bids32 = bids32[teams]
+    winners64 = team_bids64.argmax(axis=1)
+    winners32 = team_bids32.argmax(axis=1)
+
+    sorted_bids = np.sort(team_bids64, axis=1)
+    margins = (sorted_bids[:, -1] - sorted_bids[:, -2]) / scale
+    disagreements = winners64 != winners32
+    unstable = disagreements & (margins > tolerance)
+
+    print(f"Largest bid difference: {bid_error:.2e} of the bid scale")
+    print(f"Winning bidder changed for {disagreements.sum()} of {disagreements.size} team decisions, "
+          f"{unstable.sum()} of them outside near-ties")
+
+    assert bid_error < tolerance, "float32 bids drifted from the float64 bids"
+    assert not unstable.any(), "float32 changed the ranking of bids that weren't near-ties"
+
+    return bid_error, disagreements.mean()
+
+
+if __name__ == '__main__':
+    check_precision()
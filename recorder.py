@@ -0,0 +1,226 @@
+import glob
+import os
+import uuid
+
+import numpy as np
+
+
+class TrajectoryRecorder:
+    """
+    Streams the trajectories of evaluated teams to disk in fixed-size chunks.
+
+    Each chunk is a compressed .npz file holding one array per column. Rows are
+    single environment steps. Which episodes get recorded is controlled by sampling
+    every Nth team, every Nth generation and optionally only the top K teams of a
+    generation by cumulative reward.
+    """
+
+    def __init__(self, directory, chunk_size=4096, every_nth_team=1, every_nth_generation=1, top_k=None):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.every_nth_team = every_nth_team
+        self.every_nth_generation = every_nth_generation
+        self.top_k = top_k
+
+        os.makedirs(directory, exist_ok=True)
+
+        # Reopening a directory appends to it. Episode numbers continue from the last chunk,
+        # since the reader tells episodes apart by a change in episode number.
+        chunks = sorted(glob.glob(os.path.join(directory, 'chunk-*.npz')))
+        self.num_chunks = len(chunks)
+        self.num_episodes = 0
+        if chunks:
+            with np.load(chunks[-1]) as chunk:
+                self.num_episodes = int(chunk['episode'].max()) + 1
+
+        # The chunk buffer is allocated when the first observation tells us its size.
+        self.chunk = None
+        self.chunk_rows = 0
+
+        self.episode = None
+        self.pending_episodes = []
+
+    def is_sampled(self, generation, team_index):
+        return generation % self.every_nth_generation == 0 and team_index % self.every_nth_team == 0
+
+    def begin_episode(self, generation, team_index, team_id):
+        """
+        Start recording an episode. Returns False when the episode isn't sampled,
+        in which case nothing should be recorded for it.
+        """
+        if not self.is_sampled(generation, team_index):
+            return False
+
+        self.episode = {
+            'generation': generation,
+            'team_id': np.frombuffer(team_id.bytes, dtype=np.uint8),
+            'observation': [],
+            'action': [],
+            'reward': [],
+            'learner_id': []
+        }
+        return True
+
+    def record(self, observation, action, reward, learner_id):
+        self.episode['observation'].append(np.asarray(observation, dtype=np.float32))
+        self.episode['action'].append(action)
+        self.episode['reward'].append(reward)
+        self.episode['learner_id'].append(learner_id.bytes)
+
+    def end_episode(self):
+        episode, self.episode = self.episode, None
+        num_steps = len(episode['action'])
+
+        if num_steps == 0:
+            return
+
+        rows = {
+            'generation': np.full(num_steps, episode['generation'], dtype=np.int32),
+            'team_id': np.tile(episode['team_id'], (num_steps, 1)),
+            'time_step': np.arange(1, num_steps + 1, dtype=np.int32),
+            'observation': np.stack(episode['observation']),
+            'action': np.asarray(episode['action'], dtype=np.int32),
+            'reward': np.asarray(episode['reward'], dtype=np.float32),
+            'learner_id': np.frombuffer(b''.join(episode['learner_id']), dtype=np.uint8).reshape(num_steps, 16)
+        }
+
+        if self.top_k is None:
+            self._write_episode(rows)
+        else:
+            # Only the best K episodes of the generation are kept, which isn't known until it ends.
+            self.pending_episodes.append((float(rows['reward'].sum()), rows))
+
+    def end_generation(self):
+        """
+        Write out the top K episodes of the generation when sampling by fitness.
+        """
+        ranked = sorted(self.pending_episodes, key=lambda x: x[0], reverse=True)
+        for _, rows in ranked[:self.top_k]:
+            self._write_episode(rows)
+        self.pending_episodes = []
+
+    def close(self):
+        self.end_generation()
+        self._flush()
+
+    def _write_episode(self, rows):
+        rows['episode'] = np.full(len(rows['action']), self.num_episodes, dtype=np.int64)
+        self.num_episodes += 1
+
+        if self.chunk is None:
+            self.chunk = {name: np.empty((self.chunk_size,) + column.shape[1:], dtype=column.dtype)
+                          for name, column in rows.items()}
+
+        start, total = 0, len(rows['action'])
+        while start < total:
+            count = min(self.chunk_size - self.chunk_rows, total - start)
+            for name, column in rows.items():
+                self.chunk[name][self.chunk_rows:self.chunk_rows + count] = column[start:start + count]
+            self.chunk_rows += count
+            start += count
+
+            if self.chunk_rows == self.chunk_size:
+                self._flush()
+
+    def _flush(self):
+        if self.chunk is None or self.chunk_rows == 0:
+            return
+
+        path = os.path.join(self.directory, f'chunk-{self.num_chunks:06d}.npz')
+        np.savez_compressed(path, **{name: column[:self.chunk_rows] for name, column in self.chunk.items()})
+
+        self.num_chunks += 1
+        self.chunk_rows = 0
+
+
+class TrajectoryReader:
+    """
+    Reads trajectories written by the TrajectoryRecorder.
+
+    The compressed chunks are decompressed once into one uncompressed .npy file per
+    column in a cache directory, which is then memory-mapped. Columns can be sliced
+    without loading a whole run into memory.
+    """
+
+    COLUMNS = ['episode', 'generation', 'team_id', 'time_step', 'observation', 'action', 'reward', 'learner_id']
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.cache_directory = os.path.join(directory, 'cache')
+        self.chunks = sorted(glob.glob(os.path.join(directory, 'chunk-*.npz')))
+        self.columns = {}
+
+        self._build_cache()
+
+        for name in self.COLUMNS:
+            self.columns[name] = np.load(os.path.join(self.cache_directory, f'{name}.npy'), mmap_mode='r')
+
+        # Episodes are written contiguously, so each one is a slice of the columns.
+        episode = self.columns['episode']
+        boundaries = np.flatnonzero(np.diff(episode)) + 1
+        self.starts = np.concatenate(([0], boundaries)) if len(episode) else np.array([], dtype=np.int64)
+        self.ends = np.concatenate((boundaries, [len(episode)])) if len(episode) else np.array([], dtype=np.int64)
+
+    def _build_cache(self):
+        marker = os.path.join(self.cache_directory, 'chunks')
+        if os.path.exists(marker):
+            with open(marker) as f:
+                if int(f.read()) == len(self.chunks):
+                    return
+
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+        shapes, dtypes, total = {}, {}, 0
+        for path in self.chunks:
+            with np.load(path) as chunk:
+                total += len(chunk['episode'])
+                for name in self.COLUMNS:
+                    shapes[name] = chunk[name].shape[1:]
+                    dtypes[name] = chunk[name].dtype
+
+        for name in self.COLUMNS:
+            if name not in shapes:
+                # An empty recording still gets empty columns.
+                shapes[name], dtypes[name] = (), np.float32
+
+            column = np.lib.format.open_memmap(os.path.join(self.cache_directory, f'{name}.npy'), mode='w+',
+                                               dtype=dtypes[name], shape=(total,) + shapes[name])
+            row = 0
+            for path in self.chunks:
+                with np.load(path) as chunk:
+                    values = chunk[name]
+                    column[row:row + len(values)] = values
+                    row += len(values)
+            column.flush()
+            del column
+
+        with open(marker, 'w') as f:
+            f.write(str(len(self.chunks)))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def episode(self, index):
+        """
+        Return the columns of a single episode as memory-mapped views.
+        """
+        rows = slice(self.starts[index], self.ends[index])
+        episode = {name: column[rows] for name, column in self.columns.items()}
+        episode['team_id'] = uuid.UUID(bytes=bytes(episode['team_id'][0]))
+        episode['generation'] = int(episode['generation'][0])
+        return episode
+
+    def episodes(self, generation=None, team_id=None):
+        for index in range(len(self)):
+            start = self.starts[index]
+            if generation is not None and self.columns['generation'][start] != generation:
+                continue
+            if team_id is not None and bytes(self.columns['team_id'][start]) != team_id.bytes:
+                continue
+            yield self.episode(index)
+
+    def learner_ids(self, episode):
+        return [uuid.UUID(bytes=bytes(row)) for row in episode['learner_id']]
@@ -0,0 +1,415 @@
+import argparse
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from uuid import uuid4
+
+import gymnasium
+import numpy as np
+
+from checkpoint import Checkpoint
+from database import Database
+from eacg import EACG
+from parameters import Parameters
+from snapshot import PopulationSnapshot
+from trainer import evolve, run_environments_batched, run_episode
+
+# Environments are created once per worker process and reused by every episode it runs.
+environments = {}
+
+
+def network_weights(network):
+    return network.input_weights, network.bias1, network.hidden_weights, network.bias2
+
+
+def initial_weights(root_teams):
+    """
+    Copy the weights of every learner reachable from the root teams, before any training.
+    """
+    return {learner.id: [weights.copy() for weights in network_weights(learner.neuralnet)]
+            for root_team in root_teams for learner in Checkpoint.learners(root_team)}
+
+
+def weight_deltas(trained, initial):
+    """
+    How much training moved the weights of each trained learner. Deltas rather than weights
+    are returned, so that a learner trained by several tasks keeps every task's updates.
+    """
+    return {learner_id: tuple(weights - start for weights, start in
+                              zip(network_weights(learner.neuralnet), initial[learner_id]))
+            for learner_id, learner in trained.items()}
+
+
+def evaluate_team(parameters, root_team, seed, generation, run_id):
+    """
+    Worker task: play one episode for a root team on the gymnasium backend.
+    Returns the training rows, the weight deltas of the learners it trained and its run time.
+    """
+    start = time.perf_counter()
+
+    if parameters.ENVIRONMENT not in environments:
+        environments[parameters.ENVIRONMENT] = gymnasium.make(parameters.ENVIRONMENT)
+
+    initial = initial_weights([root_team])
+    trained = {}
+    training_data = run_episode(environments[parameters.ENVIRONMENT], seed, root_team, generation, run_id,
+                                parameters, trained)
+
+    return training_data, weight_deltas(trained, initial), time.perf_counter() - start
+
+
+def evaluate_population(parameters, root_teams, seed, generation, run_id):
+    """
+    Worker task: play every root team's episode at once on the numpy CartPole backend.
+    """
+    start = time.perf_counter()
+
+    initial = initial_weights(root_teams)
+    trained = {}
+    training_data = run_environments_batched(seed, None, root_teams, generation, run_id, None, parameters, trained)
+
+    return training_data, weight_deltas(trained, initial), time.perf_counter() - start
+
+
+class DatabaseWriter(threading.Thread):
+    """
+    A single thread that performs all database writes for the runs of a sweep, in the
+    order they were submitted, so that runs never wait on the database.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.jobs = queue.Queue()
+        self.error = None
+
+    def submit(self, function, *args):
+        if self.error is not None:
+            raise self.error
+        self.jobs.put((function, args))
+
+    def run(self):
+        try:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    return
+
+                function, args = job
+                try:
+                    function(*args)
+                except Exception as error:
+                    self.error = error
+                    print(f"Database writer failed: {error}")
+        finally:
+            Database.release_cursor()
+
+    def close(self):
+        self.jobs.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+
+class Run:
+    """
+    One training run of a sweep: its own parameters, population and progress.
+    """
+
+    def __init__(self, parameters, num_generations, priority=1.0, name=None):
+        self.run_id = uuid4()
+        self.parameters = parameters
+        self.num_generations = num_generations
+        self.priority = priority
+        self.name = name or str(self.run_id)[:8]
+
+        self.eacg = None
+        self.snapshot = None
+        self.mutation_rng = None
+        self.seed = None
+
+        self.generation = 0
+        self.tasks = []
+        self.outstanding = 0
+        self.results = {}
+        self.deltas = {}
+
+        # Worker seconds used, which fair-share scheduling balances against priority.
+        self.usage = 0.0
+        self.task_times = []
+        self.started = None
+        self.last_fitness = None
+        # Why the run stopped early, if it did. A failed run is finished and the rest of the sweep carries on.
+        self.error = None
+
+    @property
+    def finished(self):
+        return self.error is not None or self.generation > self.num_generations
+
+    def start(self, writer):
+        self.started = time.perf_counter()
+        self.eacg = EACG(self.parameters)
+        self.mutation_rng = np.random.default_rng(self.parameters.MUTATION_SEED)
+        # Like train(), every generation is evaluated from the same environment seed.
+        self.seed = int(self.mutation_rng.integers(2 ** 31 - 1))
+
+        self.snapshot = PopulationSnapshot.capture(self.eacg)
+        writer.submit(Database.apply_population_diff, self.run_id, self.snapshot.diff(PopulationSnapshot()))
+
+        self.generation = 1
+        self.queue_generation()
+
+    def queue_generation(self):
+        """
+        Queue the evaluation tasks of the current generation: one per root team, or
+        a single task for the whole population on the numpy backend.
+        """
+        root_teams = self.eacg.get_root_teams()
+        self.results = {}
+        self.deltas = {}
+        self.tasks = []
+        self.outstanding = 0
+
+        if not root_teams:
+            self.error = f"no root teams to evaluate in generation {self.generation}"
+            return
+
+        if self.parameters.ENVIRONMENT_BACKEND == 'numpy':
+            self.tasks = [(0, evaluate_population, (self.parameters, root_teams, self.seed, self.generation,
+                                                    self.run_id))]
+        else:
+            self.tasks = [(i, evaluate_team, (self.parameters, team, self.seed, self.generation, self.run_id))
+                          for i, team in enumerate(root_teams)]
+
+        self.outstanding = len(self.tasks)
+
+    def expected_task_time(self):
+        return float(np.mean(self.task_times[-50:])) if self.task_times else 1.0
+
+    def complete_task(self, index, training_data, deltas, elapsed, expected):
+        # The expected time was charged when the task was submitted, so only the difference is added now.
+        self.usage += elapsed - expected
+        self.task_times.append(elapsed)
+        self.results[index] = training_data
+        self.deltas[index] = deltas
+        self.outstanding -= 1
+
+    def apply_deltas(self):
+        """
+        Add every task's weight deltas to the learners. Tasks are applied in the order they
+        were queued, not the order they finished in, so a run is reproducible whatever the
+        timing of its workers. Every task trained from the same starting weights, so a
+        learner shared between root teams gets the sum of their updates.
+        """
+        learners = {learner.id: learner for learner in self.eacg.learnerPopulation}
+
+        for index in sorted(self.deltas):
+            for learner_id, deltas in self.deltas[index].items():
+                for weights, delta in zip(network_weights(learners[learner_id].neuralnet), deltas):
+                    weights += delta
+
+        self.deltas = {}
+
+    def finish_generation(self, writer):
+        """
+        Rank the evaluated generation, evolve the population and hand the writes to the
+        database writer. Ranking is done in memory, so nothing waits on the database.
+        """
+        self.apply_deltas()
+
+        training_data = [row for index in sorted(self.results) for row in self.results[index]]
+        team_rollups, generation_rollup = Database.rollup(training_data, self.parameters)
+        ranked_team_ids = [team['team_id'] for team in team_rollups]
+
+        if not ranked_team_ids:
+            self.error = f"generation {self.generation} produced no training data"
+            return
+
+        writer.submit(Database.add_training_data, training_data)
+        writer.submit(Database.add_rollups, self.run_id, self.generation, training_data, self.parameters)
+
+        if self.generation % self.parameters.CHECKPOINT_INTERVAL == 0 or self.generation == self.num_generations:
+            for champion in filter(lambda x: x.id == ranked_team_ids[0], self.eacg.get_root_teams()):
+                Checkpoint.save(champion, Checkpoint.path(self.run_id, self.generation, self.parameters),
+                                self.parameters)
+
+        removed_team_ids, removed_learner_ids = evolve(self.eacg, self.generation, ranked_team_ids,
+                                                       self.mutation_rng)
+        writer.submit(Database.add_garbage_collection_data, self.run_id, self.generation,
+                      len(removed_team_ids), len(removed_learner_ids))
+
+        current_snapshot = PopulationSnapshot.capture(self.eacg)
+        writer.submit(Database.apply_population_diff, self.run_id, current_snapshot.diff(self.snapshot))
+        self.snapshot = current_snapshot
+
+        self.last_fitness = generation_rollup
+        self.generation += 1
+        if not self.finished:
+            self.queue_generation()
+
+    def progress(self):
+        completed = min(self.generation - 1, self.num_generations)
+        elapsed = time.perf_counter() - self.started
+        line = f"[{self.name}] generation {completed}/{self.num_generations}"
+
+        if self.error is not None:
+            return line + f", failed: {self.error}"
+
+        if self.last_fitness is not None:
+            line += (f", fitness max {self.last_fitness['max_fitness']:.1f} "
+                     f"median {self.last_fitness['median_fitness']:.1f}")
+        if 0 < completed < self.num_generations:
+            remaining = elapsed / completed * (self.num_generations - completed)
+            line += f", {elapsed:.0f}s elapsed, ~{remaining:.0f}s left"
+
+        return line + f", {self.usage:.0f} worker seconds"
+
+
+class Scheduler:
+    """
+    Interleaves the generations of several runs on one shared process pool and one
+    shared database writer.
+
+    Evaluation tasks from every run are kept in flight until the pool is full. When
+    a worker frees up, the next task comes from the run with the least worker time
+    used relative to its priority ('fair'), or from the highest priority run with
+    tasks waiting ('priority'). A run whose generation is fully evaluated is evolved
+    in this process while the other runs keep the workers busy.
+    """
+
+    def __init__(self, runs, workers=None, policy='fair', tasks_per_worker=2, report_interval=10.0):
+        assert policy in ['fair', 'priority'], 'Scheduling policy not implemented.'
+
+        self.runs = runs
+        self.workers = workers
+        self.policy = policy
+        self.tasks_per_worker = tasks_per_worker
+        self.report_interval = report_interval
+
+    def next_run(self):
+        waiting = [run for run in self.runs if run.tasks]
+        if not waiting:
+            return None
+
+        if self.policy == 'priority':
+            return max(waiting, key=lambda run: (run.priority, -run.usage))
+        return min(waiting, key=lambda run: run.usage / run.priority)
+
+    def report(self):
+        for run in self.runs:
+            print(run.progress())
+
+    def run(self):
+        writer = DatabaseWriter()
+        writer.start()
+
+        for run in self.runs:
+            run.start(writer)
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                capacity = (self.workers or os.cpu_count()) * self.tasks_per_worker
+                in_flight = {}
+                last_report = time.perf_counter()
+
+                while any(not run.finished for run in self.runs):
+                    # Keep the pool saturated with tasks from whichever runs are due.
+                    while len(in_flight) < capacity:
+                        run = self.next_run()
+                        if run is None:
+                            break
+
+                        index, task, args = run.tasks.pop(0)
+                        expected = run.expected_task_time()
+                        run.usage += expected
+                        in_flight[pool.submit(task, *args)] = (run, index, expected)
+
+                    if not in_flight:
+                        # Nothing is running and nothing is queued, so no run can make progress.
+                        for run in self.runs:
+                            if not run.finished:
+                                run.error = f"no tasks to evaluate in generation {run.generation}"
+                        break
+
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        run, index, expected = in_flight.pop(future)
+                        if run.error is not None:
+                            # The run already failed; its remaining tasks are drained and ignored.
+                            continue
+
+                        try:
+                            training_data, deltas, elapsed = future.result()
+                        except Exception as error:
+                            run.error = f"task {index} of generation {run.generation} failed: {error!r}"
+                            run.tasks = []
+                            print(run.progress())
+                            continue
+
+                        run.complete_task(index, training_data, deltas, elapsed, expected)
+
+                        if run.outstanding == 0:
+                            run.finish_generation(writer)
+                            print(run.progress())
+
+                    if time.perf_counter() - last_report > self.report_interval:
+                        self.report()
+                        last_report = time.perf_counter()
+        finally:
+            writer.close()
+
+        self.report()
+
+        return [run.run_id for run in self.runs]
+
+
+def sweep(grid, num_generations, base=None, priorities=None):
+    """
+    Build one run per combination of the values in `grid`, e.g.
+    {'POPGAP': [0.3, 0.5], 'NOISE_AMOUNT': [0.1, 0.2]} gives four runs.
+    """
+    base = base or {}
+    names = list(grid)
+    runs = []
+
+    for values in itertools.product(*(grid[name] for name in names)):
+        overrides = dict(base, **dict(zip(names, values)))
+        name = ', '.join(f'{name}={value}' for name, value in zip(names, values))
+        priority = priorities.get(values, 1.0) if priorities else 1.0
+        runs.append(Run(Parameters(**overrides), num_generations, priority, name))
+
+    return runs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run a hyperparameter sweep on one shared worker pool.")
+    parser.add_argument('--generations', type=int, default=600)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--policy', choices=['fair', 'priority'], default='fair')
+    args = parser.parse_args()
+
+    print("Connecting to the database...")
+
+    Database.connect(
+        user=Parameters.DATABASE_USER_ID,
+        password=Parameters.DATABASE_PASSWORD,
+        host=Parameters.DATABASE_IP,
+        port=Parameters.DATABASE_PORT,
+        database=Parameters.DATABASE_NAME
+    )
+
+    print("Database connected.")
+
+    runs = sweep({
+        'POPGAP': [0.3, 0.5],
+        'NOISE_AMOUNT': [0.1, 0.2],
+        'POINTER_PROBABILITY': [0.25, 0.5]
+    }, args.generations)
+
+    for run in runs:
+        print(f"Run {run.run_id}: {run.name}")
+
+    Scheduler(runs, workers=args.workers, policy=args.policy).run()
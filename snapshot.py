@@ -0,0 +1,128 @@
+class PopulationDiff:
+    """
+    The changes between two population snapshots, as rows for the teams and programs tables.
+    """
+
+    def __init__(self, upserted_teams, deleted_team_ids, upserted_programs, deleted_program_keys, num_inserted):
+        self.upserted_teams = upserted_teams
+        self.deleted_team_ids = deleted_team_ids
+        self.upserted_programs = upserted_programs
+        self.deleted_program_keys = deleted_program_keys
+        self.num_inserted = num_inserted
+
+    def is_empty(self):
+        return not (self.upserted_teams or self.deleted_team_ids or
+                    self.upserted_programs or self.deleted_program_keys)
+
+    def __str__(self):
+        num_upserted = len(self.upserted_teams) + len(self.upserted_programs)
+        return (f"{self.num_inserted} inserted, {num_upserted - self.num_inserted} updated, "
+                f"{len(self.deleted_team_ids) + len(self.deleted_program_keys)} deleted")
+
+
+class PopulationSnapshot:
+    """
+    The rows the teams and programs tables should hold for a population.
+
+    Teams map their id to their lucky breaks. Programs are keyed on (learner id, team id),
+    since a learner shared between teams has a row per team, and map to their action
+    and pointer. Exactly one of those is set.
+    """
+
+    def __init__(self, teams=None, programs=None):
+        self.teams = teams if teams is not None else {}
+        self.programs = programs if programs is not None else {}
+
+    @staticmethod
+    def capture(tnng):
+        teams, programs = {}, {}
+
+        for team in tnng.teamPopulation:
+            teams[team.id] = team.lucky_breaks
+
+            for learner in team.learners:
+                if learner.is_atomic():
+                    programs[(learner.id, team.id)] = (str(learner.action), None)
+                else:
+                    programs[(learner.id, team.id)] = (None, learner.action.id)
+
+        return PopulationSnapshot(teams, programs)
+
+    def diff(self, previous):
+        """
+        Compute what changed since `previous`: new and changed rows to upsert, and the
+        keys of rows that no longer exist.
+        """
+        upserted_teams = [(team_id, lucky_breaks) for team_id, lucky_breaks in self.teams.items()
+                          if previous.teams.get(team_id) != lucky_breaks]
+        deleted_team_ids = [team_id for team_id in previous.teams if team_id not in self.teams]
+
+        upserted_programs = [(learner_id, team_id, action, pointer)
+                             for (learner_id, team_id), (action, pointer) in self.programs.items()
+                             if previous.programs.get((learner_id, team_id)) != (action, pointer)]
+        deleted_program_keys = [key for key in previous.programs if key not in self.programs]
+
+        num_inserted = (sum(team_id not in previous.teams for team_id, _ in upserted_teams) +
+                        sum((learner_id, team_id) not in previous.programs
+                            for learner_id, team_id, _, _ in upserted_programs))
+
+        return PopulationDiff(upserted_teams, deleted_team_ids, upserted_programs, deleted_program_keys,
+                              num_inserted)
+
+
+def check_sync(num_generations=15, seed=0):
+    """
+    Evolve a small population against an in-memory database standing in for Postgres,
+    syncing the teams and programs tables from a diff every generation, and check that
+    the tables hold exactly the rows of the population afterwards. Root teams are
+    ranked at random, since only the population's structure matters here.
+    """
+    import duckdb
+    import numpy as np
+    from uuid import uuid4
+
+    from database import Database
+    from eacg import EACG
+    from parameters import Parameters
+    from trainer import evolve
+
+    Database.connection = duckdb.connect()
+    Database.execute("ATTACH ':memory:' AS db;")
+    Database.execute("CREATE SCHEMA db.public;")
+    for schema in Database.schemas:
+        Database.execute(schema)
+
+    parameters = Parameters(NUM_OBSERVATIONS=4, ACTIONS=range(2), INITIAL_LEARNER_POPULATION_SIZE=200,
+                            POPULATION_SIZE=50, MUTATION_SEED=seed)
+    rng = np.random.default_rng(seed)
+    run_id = uuid4()
+
+    eacg = EACG(parameters)
+    snapshot = PopulationSnapshot.capture(eacg)
+    Database.apply_population_diff(run_id, snapshot.diff(PopulationSnapshot()))
+
+    for generation in range(1, num_generations + 1):
+        ranked_team_ids = [team.id for team in rng.permutation(eacg.get_root_teams())]
+        evolve(eacg, generation, ranked_team_ids, rng)
+
+        current_snapshot = PopulationSnapshot.capture(eacg)
+        Database.apply_population_diff(run_id, current_snapshot.diff(snapshot))
+        snapshot = current_snapshot
+
+    teams = dict(Database.execute("SELECT id, lucky_breaks FROM db.public.teams WHERE run_id = ?;",
+                                  [run_id]).fetchall())
+    programs = {(learner_id, team_id): (action, pointer) for learner_id, team_id, action, pointer in
+                Database.execute("SELECT id, team_id, action, pointer FROM db.public.programs WHERE run_id = ?;",
+                                 [run_id]).fetchall()}
+
+    assert teams == snapshot.teams, "The teams table doesn't match the population"
+    assert programs == snapshot.programs, "The programs table doesn't match the population"
+
+    Database.disconnect()
+
+    print(f"Tables matched the population after {num_generations} generations "
+          f"({len(teams)} teams, {len(programs)} programs)")
+
+
+if __name__ == '__main__':
+    check_sync()
@@ -6,20 +6,33 @@ from parameters import Parameters
 
 class Team:
 
-    def __init__(self, learner_population):
+    def __init__(self, learner_population, parameters=Parameters):
         self.id = uuid4()
         self.learners = []
-        self.referenced_by = []
+        self.referenced_by = set()
         self.lucky_breaks = 0
 
-        size = random.randint(2, Parameters.MAX_INITIAL_TEAM_SIZE)
+        size = random.randint(2, parameters.MAX_INITIAL_TEAM_SIZE)
 
         # This has to the potential to be unsafe if
         # the learner population is not large enough to have 2 distinct actions.
         while len(set(learner.action for learner in self.learners)) < 2:
             self.learners = random.sample(learner_population, k=size)
-            for learner in self.learners:
-                learner.referenced_by.append(self.id)
+
+        for learner in self.learners:
+            learner.referenced_by.add(self.id)
+
+    def clone(self):
+        """
+        A new team with a fresh id and a clone of each of this team's learners. References
+        to and from the clone are left to the caller.
+        """
+        clone = Team.__new__(Team)
+        clone.id = uuid4()
+        clone.learners = [learner.clone() for learner in self.learners]
+        clone.referenced_by = set()
+        clone.lucky_breaks = self.lucky_breaks
+        return clone
 
     def is_root_team(self):
         return len(self.referenced_by) == 0
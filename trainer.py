@@ -1,4 +1,5 @@
-import copy
+import math
+import os
 import random
 import time
 from uuid import uuid4
@@ -6,10 +7,14 @@ import gymnasium
 import numpy as np
 from matplotlib import pyplot as plt
 
+from checkpoint import Checkpoint
+from cartpole import BatchedCartPole
 from database import Database
 from mutator import Mutator
 from parameters import Parameters
 from eacg import EACG
+from recorder import TrajectoryRecorder
+from snapshot import PopulationSnapshot
 
 from visualization import Debugger
 
@@ -24,11 +29,11 @@ def toggle_rendering(event):
         print(f"Rendering {'enabled' if is_rendering else 'disabled'}.")
 
 
-def run_environment(seed, tnng, root_team, generation, run_id):
-    assert Parameters.ENVIRONMENT in ['CartPole-v1', 'LunarLander-v2'], 'Environment not implemented.'
+def run_environment(seed, tnng, root_team, generation, run_id, recorder=None, parameters=Parameters):
+    assert parameters.ENVIRONMENT in ['CartPole-v1', 'LunarLander-v2'], 'Environment not implemented.'
 
     # Initialize the environment
-    env = gymnasium.make(Parameters.ENVIRONMENT, render_mode="rgb_array")
+    env = gymnasium.make(parameters.ENVIRONMENT, render_mode="rgb_array")
 
     # Set the random seed for reproducibility
     np.random.seed(seed)
@@ -57,7 +62,7 @@ def run_environment(seed, tnng, root_team, generation, run_id):
     plt.show(block=False)
 
     # Run the environment loop
-    while step < Parameters.MAX_NUM_STEPS:
+    while step < parameters.MAX_NUM_STEPS:
         action, learner, visited = root_team.get_action(obs)  # Get action and learner from the team
 
         # Only render the current state if rendering is enabled
@@ -82,6 +87,9 @@ def run_environment(seed, tnng, root_team, generation, run_id):
         # Train the learner with the transition data
         learner.train(previous_state, rew, next_state)
 
+        if recorder is not None:
+            recorder.record(previous_state, action, rew, learner.id)
+
         # Increment step counter
         step += 1
 
@@ -93,6 +101,7 @@ def run_environment(seed, tnng, root_team, generation, run_id):
             "action": action,
             "reward": rew,
             "is_finished": term or trunc,
+            "terminated": term,
             "time_step": step,
             "time": time.time()
         })
@@ -104,18 +113,202 @@ def run_environment(seed, tnng, root_team, generation, run_id):
     # Close the plot window after the loop
     plt.close(fig)
 
+    if recorder is not None:
+        recorder.end_episode()
+
     # Return the collected training data
     return training_data
 
 
-def train(run_id, num_generations):
-    eacg = EACG()
+def run_episode(env, seed, root_team, generation, run_id, parameters=Parameters, trained=None):
+    """
+    Evaluate one root team on an existing environment without rendering. This is what
+    evaluation workers run, so the environment is passed in and reused across episodes.
+    Learners that were trained are added to `trained` by id when it is given.
+    """
+    # Set the random seed for reproducibility
+    np.random.seed(seed)
+    random.seed(seed)
+
+    obs = env.reset(seed=seed)[0]
+
+    step = 0
+    training_data = []
+
+    while step < parameters.MAX_NUM_STEPS:
+        action, learner, _ = root_team.get_action(obs)
+
+        previous_state = obs
+        obs, rew, term, trunc, info = env.step(action)
+
+        learner.train(previous_state, rew, obs)
+        if trained is not None:
+            trained[learner.id] = learner
+
+        step += 1
+
+        training_data.append({
+            "run_id": run_id,
+            "generation": generation,
+            "team_id": root_team.id,
+            "action": action,
+            "reward": rew,
+            "is_finished": term or trunc,
+            "terminated": term,
+            "time_step": step,
+            "time": time.time()
+        })
+
+        if term or trunc:
+            break
+
+    return training_data
+
+
+def run_environments_batched(seed, tnng, root_teams, generation, run_id, recorder=None, parameters=Parameters,
+                             trained=None):
+    """
+    Evaluate all root teams at once on the numpy CartPole backend. Every team plays its own
+    episode from the same seed, and all the episodes are stepped as one array operation.
+    Nothing is rendered in this mode. Learners that were trained are added to `trained`
+    by id when it is given.
+    """
+    assert parameters.ENVIRONMENT == 'CartPole-v1', 'The numpy backend only implements CartPole-v1.'
+
+    env = BatchedCartPole(len(root_teams))
 
-    for team in eacg.teamPopulation:
-        Database.add_team(run_id, team)
+    # Set the random seed for reproducibility
+    np.random.seed(seed)
+    random.seed(seed)
+
+    obs = env.reset(seed)
+
+    step = 0
+    training_data = [[] for _ in root_teams]
+    # The recorder takes one episode at a time, so sampled transitions are kept here
+    # and handed over once every episode has finished.
+    recorded = [[] if recorder is not None and recorder.is_sampled(generation, i) else None
+                for i in range(len(root_teams))]
+
+    running = np.ones(len(root_teams), dtype=bool)
+    actions = np.zeros(len(root_teams), dtype=np.int64)
+
+    while step < parameters.MAX_NUM_STEPS and running.any():
+        indices = np.flatnonzero(running)
+        learners = {}
+        for i in indices:
+            actions[i], learners[i], _ = root_teams[i].get_action(obs[i])
+
+        # Take a step in every running episode
+        previous_state = obs
+        obs, rewards, terminated, truncated = env.step(actions)
+
+        step += 1
 
-        for program in team.learners:
-            Database.add_program(run_id, program, team)
+        for i in indices:
+            learners[i].train(previous_state[i], rewards[i], obs[i])
+            if trained is not None:
+                trained[learners[i].id] = learners[i]
+
+            if recorded[i] is not None:
+                recorded[i].append((previous_state[i], actions[i], rewards[i], learners[i].id))
+
+            training_data[i].append({
+                "run_id": run_id,
+                "generation": generation,
+                "team_id": root_teams[i].id,
+                "action": int(actions[i]),
+                "reward": float(rewards[i]),
+                "is_finished": bool(terminated[i] or truncated[i]),
+                "terminated": bool(terminated[i]),
+                "time_step": step,
+                "time": time.time()
+            })
+
+        running &= ~(terminated | truncated)
+
+    for i, team in enumerate(root_teams):
+        if recorded[i] is not None:
+            recorder.begin_episode(generation, i, team.id)
+            for transition in recorded[i]:
+                recorder.record(*transition)
+            recorder.end_episode()
+
+    return [row for team_data in training_data for row in team_data]
+
+
+def evolve(eacg, generation, ranked_team_ids, mutation_rng):
+    """
+    Apply selection and breeding to a population once its root teams have been ranked,
+    best first. Survivors and lucky breaks are taken from the ranking, losing root teams
+    are released, garbage is collected, and the survivors are cloned and mutated until
+    the root population is full again. Returns the ids of the reclaimed teams and learners.
+    """
+    parameters = eacg.parameters
+
+    survivor_ids = set(ranked_team_ids[:math.floor(parameters.POPGAP * parameters.POPULATION_SIZE)])
+    root_teams = eacg.get_root_teams()
+
+    removed_teams = list(filter(lambda x: x.id not in survivor_ids, root_teams))
+    survivors = list(filter(lambda x: x.id in survivor_ids, root_teams))
+
+    # Apply lucky breaks
+    lucky_break_ids = set(ranked_team_ids[:parameters.NUM_LUCKY_BREAKS])
+    for team in filter(lambda x: x.id in lucky_break_ids, root_teams):
+        team.lucky_breaks += 1
+
+    released_teams = []
+    for root_team in removed_teams:
+        if root_team.lucky_breaks > 0:
+            root_team.lucky_breaks -= 1
+            continue
+        released_teams.append(root_team)
+
+    # Releasing the removed root teams also reclaims the learners and non-root teams
+    # that only they kept alive. Every few generations a full mark-sweep from the
+    # root teams reclaims whatever reference counting misses, like cycles.
+    removed_team_ids, removed_learner_ids = eacg.release_teams(released_teams)
+
+    if generation % parameters.GARBAGE_COLLECTION_INTERVAL == 0:
+        collected_team_ids, collected_learner_ids = eacg.collect_garbage()
+        removed_team_ids |= collected_team_ids
+        removed_learner_ids |= collected_learner_ids
+
+    # Offspring are cloned and then mutated as one cohort. Pointer mutations can turn
+    # root teams into non-root teams, so this repeats until the root population is full.
+    while len(eacg.get_root_teams()) < parameters.POPULATION_SIZE:
+        cohort = []
+        num_offspring = parameters.POPULATION_SIZE - len(eacg.get_root_teams())
+        for survivor_index in mutation_rng.integers(len(survivors), size=num_offspring):
+            cohort.append(eacg.clone_team(survivors[survivor_index]))
+
+        mutated_team_ids, mutated_learner_ids = Mutator.mutateCohort(eacg, cohort, mutation_rng)
+        removed_team_ids |= mutated_team_ids
+        removed_learner_ids |= mutated_learner_ids
+        eacg.teamPopulation.extend(cohort)
+
+    return removed_team_ids, removed_learner_ids
+
+
+def train(run_id, num_generations, parameters=Parameters):
+    eacg = EACG(parameters)
+
+    # The teams and programs tables mirror the population. They are synced from a diff
+    # against the last snapshot that was written, once at startup and after every generation.
+    snapshot = PopulationSnapshot.capture(eacg)
+    Database.apply_population_diff(run_id, snapshot.diff(PopulationSnapshot()))
+
+    recorder = None
+    if parameters.RECORD_TRAJECTORIES:
+        recorder = TrajectoryRecorder(
+            os.path.join(parameters.TRAJECTORY_DIRECTORY, str(run_id)),
+            chunk_size=parameters.TRAJECTORY_CHUNK_SIZE,
+            every_nth_team=parameters.TRAJECTORY_EVERY_NTH_TEAM,
+            every_nth_generation=parameters.TRAJECTORY_EVERY_NTH_GENERATION,
+            top_k=parameters.TRAJECTORY_TOP_K
+        )
+
+    mutation_rng = np.random.default_rng(parameters.MUTATION_SEED)
 
     seeds = [random.randint(0, 2 ** 31 - 1) for _ in range(num_generations)]
 
@@ -123,53 +316,48 @@ def train(run_id, num_generations):
     seeds = [fixed_seed for _ in range(num_generations)]
     for generation, seed in zip(range(1, num_generations + 1), seeds):
         training_data = []
-        for i, root_team in enumerate(eacg.get_root_teams()):
-            print(f"Generation {generation}. Team {i + 1} of {Parameters.POPULATION_SIZE}")
-            data = run_environment(seed, eacg, root_team, generation, run_id)
-            training_data.extend(data)
+        if parameters.ENVIRONMENT_BACKEND == 'numpy':
+            print(f"Generation {generation}. Evaluating {len(eacg.get_root_teams())} teams in parallel episodes")
+            training_data = run_environments_batched(seed, eacg, eacg.get_root_teams(), generation, run_id, recorder,
+                                                     parameters)
+        else:
+            for i, root_team in enumerate(eacg.get_root_teams()):
+                print(f"Generation {generation}. Team {i + 1} of {parameters.POPULATION_SIZE}")
+                recording = recorder is not None and recorder.begin_episode(generation, i, root_team.id)
+                data = run_environment(seed, eacg, root_team, generation, run_id, recorder if recording else None,
+                                       parameters)
+                training_data.extend(data)
+
+        if recorder is not None:
+            recorder.end_generation()
 
         Database.add_training_data(training_data)
+        Database.add_rollups(run_id, generation, training_data, parameters)
 
         print("Showing output now")
-        print(Database.get_ranked_teams(run_id, generation).sort_values('rank').head(25))
+        ranked_teams = Database.get_ranked_teams(run_id, generation).sort_values('rank')
+        print(ranked_teams.head(25))
+        ranked_team_ids = ranked_teams['team_id'].to_list()
 
-        survivor_ids = Database.get_survivor_ids(run_id, generation)
-        root_teams = eacg.get_root_teams()
+        # Checkpoint the champion so it can be served or inspected outside of training.
+        if generation % parameters.CHECKPOINT_INTERVAL == 0 or generation == num_generations:
+            for champion in filter(lambda x: x.id == ranked_team_ids[0], eacg.get_root_teams()):
+                Checkpoint.save(champion, Checkpoint.path(run_id, generation, parameters), parameters)
 
-        removed_teams = list(filter(lambda x: x.id not in survivor_ids, root_teams))
-        survivors = list(filter(lambda x: x.id in survivor_ids, root_teams))
-
-        # Apply lucky breaks
-        lucky_break_ids = Database.get_ranked_teams(run_id, generation).sort_values('rank').head(Parameters.NUM_LUCKY_BREAKS)['team_id'].to_list()
-        for team in filter(lambda x: x.id in lucky_break_ids, root_teams):
-            team.lucky_breaks += 1
+        print("Cloning existing teams and adding new teams to the database now")
+        removed_team_ids, removed_learner_ids = evolve(eacg, generation, ranked_team_ids, mutation_rng)
 
-        for root_team in removed_teams:
-            if root_team.lucky_breaks > 0:
-                root_team.lucky_breaks -= 1
-                continue
-            for learner in root_team.learners:
-                learner.referenced_by.remove(root_team.id)
-            eacg.teamPopulation.remove(root_team)
+        Database.add_garbage_collection_data(run_id, generation, len(removed_team_ids), len(removed_learner_ids))
+        print(f"Reclaimed {len(removed_team_ids)} teams and {len(removed_learner_ids)} learners")
 
-        # this is done through a list comprehension because
-        # removing elements from a list while iterating introduces bugs.
-        eacg.learnerPopulation = [learner for learner in eacg.learnerPopulation if len(learner.referenced_by) > 0]
+        current_snapshot = PopulationSnapshot.capture(eacg)
+        population_diff = current_snapshot.diff(snapshot)
+        Database.apply_population_diff(run_id, population_diff)
+        snapshot = current_snapshot
+        print(f"Synced population to the database: {population_diff}")
 
-        print("Cloning existing teams and adding new teams to the database now")
-        while len(eacg.get_root_teams()) < Parameters.POPULATION_SIZE:
-            survivor = random.choice(survivors)
-            clone = copy.deepcopy(survivor)
-            clone.referenced_by = []
-
-            clone.id = uuid4()
-            # again, being careful not to edit lists while iterating through them
-            for learner in list(clone.learners):
-                learner.id = uuid4()
-                learner.referenced_by = [clone.id]
-
-            Mutator.mutateTeam(eacg, clone)
-            eacg.teamPopulation.append(clone)
+    if recorder is not None:
+        recorder.close()
 
 
 if __name__ == '__main__':
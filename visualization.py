@@ -11,7 +11,9 @@ import matplotlib.pyplot as plt
 
 
 import math
+import os
 import uuid
+from multiprocessing import Pool
 
 
 class Debugger:
@@ -21,11 +23,27 @@ class Debugger:
     the policy graphs created by root teams.
     """
 
-    def plotTeam(_team: Team, tnng, ax) -> None:
+    # Layouts are keyed on the structure of the graph (its nodes and edges),
+    # so redrawing a policy graph that hasn't changed skips graphviz entirely.
+    layout_cache = {}
+    LAYOUT_CACHE_SIZE = 256
+
+    # If at most this fraction of the nodes are new compared to a cached layout,
+    # only the new nodes are placed and the rest keep their previous positions.
+    INCREMENTAL_LAYOUT_THRESHOLD = 0.2
+
+    @staticmethod
+    def buildGraph(_team: Team, tnng, index=None) -> nx.DiGraph:
         """
-        Display the policy graph for a root team, showing all learners, their actions,
-        and recursively drawing any referenced teams and their learners.
+        Build the policy graph for a root team, showing all learners, their actions,
+        and recursively adding any referenced teams and their learners.
+
+        `index` maps team ids to teams in `tnng.teamPopulation`. It is built on demand
+        when not provided; pass one in when building several graphs from the same population.
         """
+        if index is None:
+            index = {team.id: team for team in tnng.teamPopulation}
+
         G = nx.DiGraph()
 
         def process_team(team):
@@ -44,24 +62,86 @@ class Debugger:
                 G.add_edge(team.id, learner.id)  # Connect the team to the learner
 
                 if learner.is_atomic():
-                    # If the learner is atomic, add a node for the action and connect it to the learner
-                    action_id = str(uuid.uuid4())  # Create a unique ID for the action node
+                    # If the learner is atomic, add a node for the action and connect it to the learner.
+                    # The id is derived from the learner so that unchanged graphs hit the layout cache.
+                    action_id = uuid.uuid5(learner.id, str(learner.action))
                     G.add_node(action_id, label=learner.action, color='white', node_type='action', size=150)
                     G.add_edge(learner.id, action_id)  # Connect the learner to the action
                 else:
-                    # For non-atomic learners, find the referenced team and process it recursively
-                    for other_team in tnng.teamPopulation:
-                        if other_team.id == learner.action.id:
-                            process_team(other_team)
-                            G.add_edge(learner.id, other_team.id)  # Connect the learner to the referenced team
+                    # For non-atomic learners, look up the referenced team and process it recursively
+                    other_team = index.get(learner.action.id)
+                    if other_team is not None:
+                        process_team(other_team)
+                        G.add_edge(learner.id, other_team.id)  # Connect the learner to the referenced team
 
         visited = set()
 
         # Start processing the root team
         process_team(_team)
 
-        # Plot the graph using 'neato' layout
-        pos = nx.nx_agraph.graphviz_layout(G, prog='neato')
+        return G
+
+    @staticmethod
+    def layout(G: nx.DiGraph) -> dict:
+        """
+        Compute node positions for a policy graph using the 'neato' layout.
+
+        Identical structures are served from the layout cache. When a cached layout
+        shares most of its nodes with G, the shared nodes are pinned and only the
+        new nodes are placed, instead of recomputing the whole layout.
+        """
+        key = (frozenset(G.nodes), frozenset(G.edges))
+
+        if key in Debugger.layout_cache:
+            return Debugger.layout_cache[key]
+
+        nodes = key[0]
+        closest_key, closest_overlap = None, 0
+        for cached_key in Debugger.layout_cache:
+            overlap = len(nodes & cached_key[0])
+            if overlap > closest_overlap:
+                closest_key, closest_overlap = cached_key, overlap
+
+        changed = len(nodes) - closest_overlap
+        if closest_key is not None and changed <= Debugger.INCREMENTAL_LAYOUT_THRESHOLD * len(nodes):
+            previous = Debugger.layout_cache[closest_key]
+            fixed = [n for n in G.nodes if n in previous]
+            initial = {n: previous[n] for n in fixed}
+
+            # Start each new node just off a positioned neighbour, inside the existing extent, so it
+            # begins close to where it belongs. New nodes chained off other new nodes are placed in turn.
+            xs, ys = [x for x, _ in initial.values()], [y for _, y in initial.values()]
+            offset = 0.05 * max(max(xs) - min(xs), max(ys) - min(ys), 1.0)
+            centre = (sum(xs) / len(xs), sum(ys) / len(ys))
+
+            unplaced = [n for n in G.nodes if n not in initial]
+            while unplaced:
+                placed = False
+                for n in list(unplaced):
+                    neighbours = [m for m in nx.all_neighbors(G, n) if m in initial]
+                    if neighbours:
+                        x, y = initial[neighbours[0]]
+                        initial[n] = (x + offset, y - offset)
+                        unplaced.remove(n)
+                        placed = True
+                if not placed:
+                    initial[unplaced.pop(0)] = centre
+
+            # networkx scales its default spacing k to the extent of the given positions. The layout
+            # runs on the undirected view, otherwise a new node feels no pull from the node pointing at it.
+            pos = nx.spring_layout(G.to_undirected(as_view=True), pos=initial, fixed=fixed or None, seed=0)
+        else:
+            pos = graphviz_layout(G, prog='neato')
+
+        if len(Debugger.layout_cache) >= Debugger.LAYOUT_CACHE_SIZE:
+            # Evict the oldest entry; dicts preserve insertion order.
+            del Debugger.layout_cache[next(iter(Debugger.layout_cache))]
+        Debugger.layout_cache[key] = pos
+
+        return pos
+
+    @staticmethod
+    def drawGraph(G: nx.DiGraph, pos: dict, ax) -> None:
         colors = [G.nodes[n]['color'] for n in G.nodes]
         labels = nx.get_node_attributes(G, 'label')
         sizes = [G.nodes[n]['size'] for n in G.nodes]
@@ -75,3 +155,44 @@ class Debugger:
         nx.draw_networkx_edges(G, pos, ax=ax, width=1.5, arrows=True, arrowstyle='-|>', min_source_margin=10,
                                min_target_margin=10)
 
+    def plotTeam(_team: Team, tnng, ax, index=None) -> None:
+        """
+        Display the policy graph for a root team, showing all learners, their actions,
+        and recursively drawing any referenced teams and their learners.
+        """
+        G = Debugger.buildGraph(_team, tnng, index)
+        pos = Debugger.layout(G)
+        Debugger.drawGraph(G, pos, ax)
+
+    @staticmethod
+    def renderGraph(G: nx.DiGraph, path: str) -> str:
+        """
+        Lay out a policy graph and save it as an SVG file. Runs inside worker processes.
+        """
+        import matplotlib
+        matplotlib.use('Agg')
+
+        fig, ax = plt.subplots(figsize=(12, 12))
+        Debugger.drawGraph(G, Debugger.layout(G), ax)
+        fig.savefig(path, format='svg')
+        plt.close(fig)
+
+        return path
+
+    @staticmethod
+    def renderChampions(champions: List[Team], tnng, directory: str, processes=None) -> List[str]:
+        """
+        Render the policy graphs of all champions to SVG files in `directory`, one file per team.
+
+        The graphs are built in this process using a single id to team index. Only the plain
+        graphs are sent to a pool of worker processes, which do the layout and drawing.
+        Returns the paths of the written files.
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        index = {team.id: team for team in tnng.teamPopulation}
+        jobs = [(Debugger.buildGraph(team, tnng, index), os.path.join(directory, f"{team.id}.svg"))
+                for team in champions]
+
+        with Pool(processes=processes) as pool:
+            return pool.starmap(Debugger.renderGraph, jobs)